@@ -0,0 +1,248 @@
+"""
+Benchmark of the stage / convert / load pipeline on synthetic Comptes workbooks,
+with a local SQLite database standing in for Postgres.
+
+    python -m benchmarks.pipeline [-rows=N] [-months=M] [-years=Y] [-baseline=FILE] [-threshold=T] [-save]
+
+Each stage records its duration, throughput and peak memory. The results are compared to the
+baseline, the run fails when a stage is slower or uses more memory than the baseline by more
+than the threshold. -save writes the results as the new baseline.
+"""
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+from odf.table import Table, TableRow
+
+import finance.database as database
+import finance.finance_extractor as fe
+import finance.ods_io as ods_io
+import finance.output as o
+import finance.schema as schema
+from finance.finance_salaries import SalaryExtractor
+
+BASELINE_FILE = Path(__file__).parent.joinpath('baseline.json')
+CATEGORIES = ['alimentation', 'logement', 'santé', 'transport', 'loisirs', 'revenus']
+SALARY_ITEMS = [('Revenus', 'Salaire de base'), ('Revenus', 'Prime'), ('Retenues', 'CSG'),
+                ('Retenues', 'CRDS'), ('Retenues', 'Retraite'), ('Retenues', 'Mutuelle')]
+
+
+def generate_mouvement(year: int, i: int) -> list:
+    """ the cells of the i-th row of a Mouvements sheet, in the order of the schema"""
+    date = dt.datetime(year, 1, 1) + dt.timedelta(days=i % 365)
+    refund = i % 10 == 0
+    values = {'Date': ods_io.generate_table_cell_datetime(date),
+              'N°': ods_io.generate_table_cell_float(float(i)),
+              'Description': ods_io.generate_table_cell_text(f'Opération {i}'),
+              'Dépense': ods_io.generate_table_cell_float(round(10 + (i * 7.31) % 500, 2)),
+              'N° de référence': ods_io.generate_table_cell_text(f'REF{i:06d}'),
+              'Recette': ods_io.generate_table_cell_float(1500.0) if i % 30 == 0 else ods_io.generate_cell_empty(),
+              'Taux de remboursement': ods_io.generate_table_cell_float(0.7) if refund
+              else ods_io.generate_cell_empty(),
+              'Compte': ods_io.generate_table_cell_text('Courant'),
+              'Catégorie': ods_io.generate_table_cell_text(CATEGORIES[i % len(CATEGORIES)]),
+              'Economie': ods_io.generate_table_cell_text(str(i % 3 == 0)),
+              'Réglé': ods_io.generate_table_cell_text(str(i % 2 == 0)),
+              'Mois': ods_io.generate_table_cell_datetime(dt.datetime(date.year, date.month, 1)),
+              "Date d'insertion": ods_io.generate_table_cell_datetime(date),
+              'Provision à payer': ods_io.generate_cell_empty(),
+              'Provision à récupérer': ods_io.generate_cell_empty(),
+              'Date remboursement': ods_io.generate_cell_empty(),
+              'Organisme': ods_io.generate_table_cell_text('CPAM') if refund else ods_io.generate_cell_empty(),
+              'Fait Marquant': ods_io.generate_table_cell_text('Remarque') if i % 50 == 0
+              else ods_io.generate_cell_empty()}
+    return [values[c] for c in schema.get_column_names() if c in values]
+
+
+def generate_workbook(p: Path, year: int, rows: int, months: int):
+    """ creates a Comptes workbook : a Mouvements sheet with rows movements
+    and a Salaires sheet with months monthly columns"""
+    wkb = ods_io.SpreadsheetWrapper()
+
+    mouvements = Table(name='Mouvements')
+    row = TableRow()
+    row.addElement(ods_io.generate_table_cell_text(f'Comptes {year}'))
+    mouvements.addElement(row)
+    row = TableRow()
+    for c in schema.get_column_names():
+        if c != 'File Year':
+            row.addElement(ods_io.generate_table_cell_text(c))
+    mouvements.addElement(row)
+    for i in range(rows):
+        row = TableRow()
+        for cell in generate_mouvement(year, i):
+            row.addElement(cell)
+        mouvements.addElement(row)
+    wkb.element.spreadsheet.addElement(mouvements)
+
+    salaires = Table(name='Salaires')
+    for values in [['Salaires'], [], ['Catégorie', 'Item', 'Commentaire']]:
+        row = TableRow()
+        for v in values:
+            row.addElement(ods_io.generate_table_cell_text(v))
+        salaires.addElement(row)
+    for j in range(months):
+        month = dt.date(year - months // 12 + (j // 12), j % 12 + 1, 1)
+        salaires.lastChild.addElement(ods_io.generate_table_cell_text(month.strftime('%d/%m/%y')))
+    for k, (category, item) in enumerate(SALARY_ITEMS):
+        row = TableRow()
+        for v in [category, item, '']:
+            row.addElement(ods_io.generate_table_cell_text(v))
+        for j in range(months):
+            # french format, e.g. 2.500,00 €
+            amount = f'{2500 + 10 * j - 300 * k:,.2f}'.replace(',', ' ').replace('.', ',').replace(' ', '.')
+            row.addElement(ods_io.generate_table_cell_text(amount + ' €'))
+        salaires.addElement(row)
+    wkb.element.spreadsheet.addElement(salaires)
+
+    wkb.save(p)
+
+
+@contextlib.contextmanager
+def workspace(folder: Path):
+    """ points the home folders of the pipeline and its databases to the benchmark folder"""
+    saved = (os.environ.get('HOME'), fe.FileStager.__staging_folder__, fe.FileConverter.__extract_folder__,
+             fe.FileManifest.__manifest_file__, fe.DatabaseConverter.__connection_string__,
+             database.CONNECTION_STRING)
+    for name in ['Bureau', 'Comptes', 'Extracts']:
+        folder.joinpath(name).mkdir()
+    os.environ['HOME'] = str(folder)
+    fe.FileStager.__staging_folder__ = folder.joinpath('Comptes')
+    fe.FileConverter.__extract_folder__ = folder.joinpath('Extracts')
+    fe.FileManifest.__manifest_file__ = folder.joinpath('Extracts.manifest.json')
+    database.CONNECTION_STRING = 'sqlite+pysqlite:///' + folder.joinpath('finance.sqlite').as_posix()
+    fe.DatabaseConverter.__connection_string__ = database.CONNECTION_STRING
+    try:
+        yield folder
+    finally:
+        database.DatabaseSink(database.CONNECTION_STRING).get_engine().dispose()
+        if saved[0] is not None:
+            os.environ['HOME'] = saved[0]
+        (fe.FileStager.__staging_folder__, fe.FileConverter.__extract_folder__, fe.FileManifest.__manifest_file__,
+         fe.DatabaseConverter.__connection_string__, database.CONNECTION_STRING) = saved[1:]
+
+
+class Benchmark:
+    """ This class times the stages and keeps their results"""
+    __results__: dict
+
+    def __init__(self):
+        self.__results__ = {}
+
+    def get_results(self) -> dict:
+        return self.__results__
+
+    def measure(self, name: str, rows: int, function, *args):
+        """ runs the function, silently, and records its duration, throughput and peak memory
+        :return: the result of the function"""
+        level = o.logger.level
+        o.set_level('quiet')
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            o.logger.setLevel(level)
+        self.__results__[name] = {'seconds': round(seconds, 4), 'rows': rows,
+                                  'rows_per_second': round(rows / seconds) if seconds > 0 else None,
+                                  'peak_memory_mb': round(peak / 2 ** 20, 2)}
+        print(f'{name:<24}{seconds:>10.3f}s{rows:>10} rows{peak / 2 ** 20:>10.1f} MB')
+        return result
+
+
+def run(rows: int, months: int, years: int) -> dict:
+    bench = Benchmark()
+    with tempfile.TemporaryDirectory() as folder, workspace(Path(folder)) as home:
+        for year in range(2024 - years, 2024):
+            generate_workbook(home.joinpath('Bureau', f'Comptes {year}.ods'), year, rows, months)
+        total = rows * years
+
+        bench.measure('stage', years, fe.stage, True)
+        bench.measure('convert', total, fe.convert, 1, True)
+        bench.measure('load', total, fe.load)
+
+        fl = fe.FileLoader()
+        loaded = pd.concat([fl.load_dataframe(p) for p in fe.FileConverter().get_converted_files()
+                            if p.suffix == '.csv'])
+        bench.measure('cleanup_dataframe', total, fl.cleanup_dataframe, loaded)
+
+        se = SalaryExtractor()
+        sheet = se.get_salary_sheet(se.get_spreadsheet(home.joinpath('Comptes', f'Comptes {2023}.ods')))
+        bench.measure('parse_salary_sheet', months * len(SALARY_ITEMS), se.parse_salary_sheet, sheet)
+
+        df = loaded.head(rows).reset_index(drop=True)
+        target = ods_io.SheetWrapper(Table(name='Export'))
+        bench.measure('insert_from_dataframe', len(df), target.insert_from_dataframe, df, True, 'overwrite', True)
+    return bench.get_results()
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """ :return: the regressions, as messages"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for measure in ['seconds', 'peak_memory_mb']:
+            if reference[measure] > 0 and result[measure] > reference[measure] * (1 + threshold):
+                regressions.append(f'{name} : {measure} {result[measure]} against {reference[measure]} '
+                                   f'(+{result[measure] / reference[measure] - 1:.0%})')
+    return regressions
+
+
+def main(args=None) -> int:
+    args = sys.argv[1:] if args is None else args
+    params = {'rows': 5000, 'months': 60, 'years': 2}
+    baseline_file = BASELINE_FILE
+    threshold = 0.25
+    save = False
+    for param in args:
+        name, _, value = param.lstrip('-').partition('=')
+        if name in params:
+            params[name] = int(value)
+        elif name == 'baseline':
+            baseline_file = Path(value)
+        elif name == 'threshold':
+            threshold = float(value)
+        elif name == 'save':
+            save = True
+        else:
+            print(__doc__)
+            return 2
+
+    results = run(**params)
+    summary = {'params': params, 'stages': results}
+    print(json.dumps(summary, indent=2))
+
+    status = 0
+    if baseline_file.exists():
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print(f'the baseline was recorded with {baseline["params"]}, not compared')
+        else:
+            regressions = compare(results, baseline['stages'], threshold)
+            for r in regressions:
+                print(f'REGRESSION {r}')
+            status = 1 if len(regressions) > 0 else 0
+    if save:
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f'baseline saved : {baseline_file}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,14 @@
 from pathlib import Path
+import asyncio
 import sys
 from finance.finance_extractor import load, load_from_sqlite
 from finance.finance_extractor import stage
 from finance.finance_extractor import convert
 from finance.finance_extractor import FileStager
-from finance.finance_listener import ComptesModifiedHandler
+from finance.finance_listener import ListenerRuntime
 from finance.finance_salaries import SalaryExtractor
-from watchdog.observers import Observer
+import finance.instrumentation as instrumentation
 import finance.output as o
-from time import sleep
 
 
 def get_helpstring():
@@ -21,6 +21,18 @@ def get_helpstring():
             -sqlite : load from SQLite into the database
             -salaires : load the salaries
             -listen : start the listener feature
+            -workers=N : number of processes used by the conversion and the listener
+            -force : stage and convert all the files, even the unchanged ones
+            -format=F : format of the extracts, csv (default), feather or parquet
+            -delta : load only the extracts changed since the last load, replacing their years,
+                     and merge the salaries into their table, month by month
+            -chunksize=N : stream the extracts, or the SQLite rows, into the database N rows at a time
+            -watermark=COLUMN : migrate from SQLite only the rows at or above the highest COLUMN already loaded
+            -memory : measure the peak memory of each step with tracemalloc, slower than the default peak RSS
+            -profile=STEP : dump a cProfile of a step, e.g. load or Comptes 2023.ods, into STEP.prof
+            -summary=FILE : write the JSON timing summary of the run to FILE instead of the console
+            -log=LEVEL : quiet, info (default) or debug
+            -logfile=FILE : write the messages to FILE as well, rotated every 10 MB, e.g. for the listener
             -h  :   list the help"""
     return t
 
@@ -36,6 +48,15 @@ def main(args=None, config_file: Path = None):
         run_load_sqlite = False
         run_salaries = False
         run_listener = False
+        workers = None
+        force = False
+        extract_format = 'csv'
+        delta = False
+        chunksize = None
+        watermark_column = None
+        trace_memory = False
+        profiled_span = None
+        summary_file = None
 
         try:
             for param in args:
@@ -59,51 +80,80 @@ def main(args=None, config_file: Path = None):
                     run_load = True
                 elif param == '-sqlite':
                     run_load_sqlite = True
+                elif param == '-force':
+                    force = True
+                elif param == '-delta':
+                    delta = True
+                elif param.startswith('-workers='):
+                    workers = int(param.split('=')[1])
+                elif param.startswith('-chunksize='):
+                    chunksize = int(param.split('=')[1])
+                elif param.startswith('-watermark='):
+                    watermark_column = param.split('=')[1]
+                elif param.startswith('-format='):
+                    extract_format = param.split('=')[1]
+                elif param == '-memory':
+                    trace_memory = True
+                elif param.startswith('-profile='):
+                    profiled_span = param.split('=')[1]
+                elif param.startswith('-summary='):
+                    summary_file = Path(param.split('=')[1])
+                elif param.startswith('-log='):
+                    o.set_level(param.split('=')[1])
+                elif param.startswith('-logfile='):
+                    o.log_to_file(Path(param.split('=')[1]))
                 else:
                     print(get_helpstring())
-        except IndexError:
+        except (IndexError, KeyError):
             print(get_helpstring())
 
         if run_listener:
             fs = FileStager()
-            event_handler = ComptesModifiedHandler()
-            observer = Observer()
-            observer.schedule(event_handler, path=fs.get_staging_folder(), recursive=False)
-            observer.start()
+            runtime = ListenerRuntime(fs.get_staging_folder(), workers, extract_format=extract_format)
             o.print_title('Starting Listener')
             try:
-                while True:
-                    o.print_event(f'listening')
-                    sleep(2)
+                asyncio.run(runtime.run())
             except KeyboardInterrupt:
-                observer.stop()
-
-            observer.join()
+                o.print_event('listener stopped')
         else:
-            if run_stage:
-                o.print_title('Running staging mechanism')
-                stage()
+            instrumentation.start(trace_memory, profiled_span)
+            try:
+                if run_stage:
+                    o.print_title('Running staging mechanism')
+                    with instrumentation.span('stage'):
+                        stage(force)
 
-            if run_convert:
-                o.print_title('Running conversion mechanism')
-                convert()
+                if run_convert:
+                    o.print_title('Running conversion mechanism')
+                    with instrumentation.span('convert'):
+                        convert(workers, force, extract_format)
 
-            if run_load:
-                o.print_title('Running loading mechanism')
-                load()
-            if run_load_sqlite:
-                o.print_title('Running loading from SQLite')
-                load_from_sqlite()
+                if run_load:
+                    o.print_title('Running loading mechanism')
+                    with instrumentation.span('load'):
+                        load(extract_format, delta, chunksize)
+                if run_load_sqlite:
+                    o.print_title('Running loading from SQLite')
+                    with instrumentation.span('sqlite'):
+                        load_from_sqlite(chunksize or 10000, watermark_column)
 
-            if run_salaries:
-                o.print_title('Running salaries loading')
-                se = SalaryExtractor()
-                f = se.get_source_file()
-                wkb = se.get_spreadsheet(f)
-                sheet = se.get_salary_sheet(wkb)
-                salaires = se.parse_salary_sheet(sheet)
-                df = se.convert_salaries_to_dataframe(salaires)
-                se.save_dataframe_to_sql(df)
+                if run_salaries:
+                    o.print_title('Running salaries loading')
+                    with instrumentation.span('salaries') as s:
+                        se = SalaryExtractor()
+                        f = se.get_source_file()
+                        with instrumentation.span('read'):
+                            wkb = se.get_spreadsheet(f)
+                            sheet = se.get_salary_sheet(wkb)
+                        with instrumentation.span('parse'):
+                            df = se.parse_salary_sheet(sheet)
+                        with instrumentation.span('save', len(df)):
+                            se.save_dataframe_to_sql(df, delta)
+                        s.add_rows(len(df))
+            finally:
+                # the summary is emitted even when a step failed, with the steps run so far
+                o.print_title('Run summary')
+                instrumentation.save_summary(instrumentation.stop(), summary_file)
 
 
 if __name__ == '__main__':
@@ -1,21 +1,82 @@
 """
 We first define the main function
 """
+import hashlib
+import json
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+from typing import Iterator
 import pandas as pd
-import pyexcel_ods3
 from datetime import datetime
 
 import sqlalchemy
 
-from finance.database import load_to_table
-from finance.database import get_row_count
+from finance.ods_reader import SheetReader
+from finance.database import DatabaseSink
+from finance.database import prefetch
+import finance.schema as schema
+import finance.instrumentation as instrumentation
 import finance.output as o
 import re
 
 from pathlib import Path
 
 
+class FileManifest:
+    """This class records the files already processed, to skip them while they are unchanged"""
+    __manifest_file__ = Path.home().joinpath('Extracts.manifest.json')
+    """
+    The manifest sits next to the Extracts folder. For each step (stage, convert, load),
+    it records the size, modification time and content hash of each source file
+    and the output produced from it.
+    """
+    __entries__: dict
+
+    def __init__(self, manifest_file: Path = None):
+        if manifest_file is not None:
+            self.__manifest_file__ = manifest_file
+        try:
+            with open(self.__manifest_file__, encoding='utf-8') as f:
+                self.__entries__ = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.__entries__ = {}
+
+    def get_manifest_file(self) -> Path:
+        return self.__manifest_file__
+
+    def get_hash(self, p: Path) -> str:
+        h = hashlib.sha256()
+        with open(p, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def is_changed(self, step: str, p: Path, output: Path) -> bool:
+        """ checks if the file changed since it was last processed by the step.
+        The hash is only computed when the size or the modification time moved"""
+        entry = self.__entries__.get(step, {}).get(str(p))
+        if entry is None or entry['output'] != str(output) or not output.exists():
+            return True
+        stat = p.stat()
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return False
+        if entry['size'] == stat.st_size and entry['hash'] == self.get_hash(p):
+            # touched but identical, keep the new time to skip the hash next time
+            entry['mtime'] = stat.st_mtime
+            return False
+        return True
+
+    def record(self, step: str, p: Path, output: Path):
+        stat = p.stat()
+        self.__entries__.setdefault(step, {})[str(p)] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                                         'hash': self.get_hash(p), 'output': str(output)}
+
+    def save(self):
+        with open(self.__manifest_file__, 'w', encoding='utf-8') as f:
+            json.dump(self.__entries__, f, indent=2)
+
+
 class FileStager:
     """This class has the responsibility for picking the right files and stage them"""
     __staging_folder__ = Path.home().joinpath('Comptes')
@@ -32,14 +93,26 @@ class FileStager:
         except FileExistsError:
             return False
 
-    def sweep_and_push(self, folder: Path, mask: str, targetfolder: Path) -> int:
-        files = [p for p in folder.iterdir() if p.name.find(mask) > -1]
+    def sweep_and_push(self, folder: Path, mask: str, targetfolder: Path, force: bool = False) -> int:
+        """ copies the matching files to the target folder.
+        Files unchanged since their last copy are skipped, unless force is True
+        :return: the number of files copied"""
+        files = [p for p in folder.iterdir() if re.match(mask, p.name)]
+        manifest = FileManifest()
+        copied = 0
         for f in files:
             o.print_event(f'* file found : {f}')
+            target = targetfolder.joinpath(f.name)
+            if not force and not manifest.is_changed('stage', f, target):
+                o.print_event(f'* file unchanged, skipped')
+                continue
             shutil.copy2(f, targetfolder)
+            manifest.record('stage', f, target)
+            copied += 1
             o.print_event(f'* file copied in target folder : {targetfolder}')
+        manifest.save()
 
-        return len(files)
+        return copied
 
     def is_valid_file(self, filename: str) -> bool:
         mask = r'^Comptes.*'
@@ -63,34 +136,80 @@ class FileConverter:
     def get_converted_files(self):
         return self.__extract_folder__.iterdir()
 
-    def convert_account_file(self, p: Path) -> pd.DataFrame:
-        """ This class converts an account file"""
-        data = pyexcel_ods3.get_data(str(p))
+    __extract_formats__ = {'csv': '.csv', 'feather': '.feather', 'parquet': '.parquet'}
+    """
+    The extract formats and their file suffixes. feather (Arrow IPC) and parquet keep the column types,
+    feather is written uncompressed so that it can be read back memory-mapped.
+    csv remains available for the other tools. The columnar formats require pyarrow.
+    """
 
-        # get the sheet
-        mouvements_sheet = data['Mouvements']
-        o.print_event('sheet retrieved')
+    def get_extract_suffix(self, extract_format: str) -> str:
+        try:
+            return self.__extract_formats__[extract_format]
+        except KeyError:
+            raise ValueError(f'unknown extract format {extract_format}, '
+                             f'expected one of {", ".join(self.__extract_formats__)}')
 
-        # find the first row of the headers
-        r = 0
-        while mouvements_sheet[r][0] != 'Date':
-            r += 1
+    def get_extract_path(self, name: str, extract_format: str = 'csv') -> Path:
+        return self.__extract_folder__.joinpath(name + self.get_extract_suffix(extract_format))
 
-        # extract the table
-        mouvements: []
-        mouvements = mouvements_sheet[r + 1::]
+    def convert_account_file(self, p: Path) -> pd.DataFrame:
+        """ This class converts an account file"""
+        # stream the sheet, the other sheets of the workbook are skipped
+        # the amounts are read from the typed cell values, without the currency text
+        reader = SheetReader(p, 'Mouvements', keep_currency=False)
 
-        headers: []
-        headers = mouvements_sheet[r:r + 1:]
+        # find the first row of the headers
+        headers, mouvements = reader.read_table('Date')
+        o.print_event('sheet retrieved')
 
         # create a pandas dataframe
-        df = pd.DataFrame(mouvements, columns=headers)
+        df = pd.DataFrame(list(mouvements), columns=[headers])
         o.print_event('pandas Dataframe created')
         return df
 
-    def save_dataframe(self, df: pd.DataFrame, csv_name: str):
+    def get_column_names(self, columns: pd.Index) -> list:
+        """ flattens the header row into unique texts, naming the blank and duplicated headers
+        the way read_csv does"""
+        result = []
+        for i, c in enumerate(columns):
+            name = str(c[0] if isinstance(c, tuple) else c)
+            if name == '':
+                name = f'Unnamed: {i}'
+            unique_name = name
+            n = 0
+            while unique_name in result:
+                n += 1
+                unique_name = f'{name}.{n}'
+            result.append(unique_name)
+        return result
+
+    def type_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ prepares the dataframe for a columnar format, where each column holds a single type.
+        Empty cells become nulls, the numeric and boolean columns keep their types,
+        the other columns are stored as the texts the csv extract would hold, so that
+        the loader sees the same dates, including the 9999-12-31 placeholder"""
+        result = pd.DataFrame(index=range(len(df)))
+        for i, name in enumerate(self.get_column_names(df.columns)):
+            values = df.iloc[:, i].reset_index(drop=True)
+            values = values.mask(values.astype(object) == '')
+            inferred = pd.api.types.infer_dtype(values, skipna=True)
+            if inferred in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+                values = pd.to_numeric(values)
+            elif inferred != 'boolean':
+                values = values.map(str, na_action='ignore')
+            result[name] = values
+        return result
+
+    def save_dataframe(self, df: pd.DataFrame, name: str, extract_format: str = 'csv'):
         # save the dataframe
-        df.to_csv(self.__extract_folder__.joinpath(csv_name + '.csv'))
+        p = self.get_extract_path(name, extract_format)
+        if extract_format == 'csv':
+            df.to_csv(p)
+        elif extract_format == 'feather':
+            self.type_dataframe(df).to_feather(p, compression='uncompressed')
+        else:
+            self.type_dataframe(df).to_parquet(p, index=False)
 
 
 class DatabaseConverter():
@@ -99,7 +218,7 @@ class DatabaseConverter():
 
     def get_transactions(self) -> pd.DataFrame:
         """ This class loads from the sqlite database"""
-        e = sqlalchemy.create_engine(self.__connection_string__)
+        e = DatabaseSink(self.__connection_string__).get_engine()
         with e.connect() as conn:
             df = pd.read_sql_table('comptes', conn)
 
@@ -109,27 +228,70 @@ class DatabaseConverter():
 
         return df
 
+    def iter_transactions(self, chunksize: int, watermark_column: str = None, watermark=None) \
+            -> Iterator[pd.DataFrame]:
+        """ streams the transactions of the sqlite database, chunksize rows at a time,
+        through a server side cursor
+        :param watermark_column: the column selecting the rows to stream, e.g. Date d'insertion
+        :param watermark: only the rows whose watermark column is at or above it are streamed, None for all the rows.
+            The rows on the watermark are streamed again, since rows may have been added on it since
+        """
+        e = DatabaseSink(self.__connection_string__).get_engine()
+        with e.connect().execution_options(stream_results=True) as conn:
+            # the reflected column types convert the dates, as read_sql_table does
+            table = sqlalchemy.Table('comptes', sqlalchemy.MetaData(), autoload_with=conn)
+            query = sqlalchemy.select(table)
+            if watermark is not None:
+                column = table.c[watermark_column]
+                if isinstance(column.type, sqlalchemy.DateTime):
+                    watermark = pd.Timestamp(watermark).to_pydatetime()
+                query = query.where(column >= watermark)
+            for df in pd.read_sql(query, conn, chunksize=chunksize):
+                df.set_index('index', inplace=True)
+                # Add a date checker column
+                df['Date Out of Bound'] = df['Date'].dt.year > df['File Year']
+                yield df
+
 
 class FileLoader:
     """ class for loading csv files into the Postgresql database"""
     __table_comptes__ = 'comptes'
     __acceptables_columns = ()
 
-    def __init__(self, acceptable_columns: set):
+    def __init__(self, acceptable_columns: tuple = schema.get_column_names()):
+        """
+        :param acceptable_columns: the columns to load, the others are not read from the extracts.
+            The types of the columns come from the schema registry
+        """
         self.__acceptables_columns = acceptable_columns
 
     def replace_euros_in_column(self, col: pd.Series) -> pd.Series:
-        """ Removes the euros and converts to numeric"""
-        result = col.str.replace(' EUR', '')
-        result = pd.to_numeric(result)
+        """ Removes the euros and converts to numeric.
+        Recent extracts already hold numbers, older ones hold '<amount> EUR' texts"""
+        if pd.api.types.is_numeric_dtype(col):
+            return col
+        result = col.replace(' EUR', '', regex=True)
+        # always float, the chunks of a load must agree on the type
+        result = pd.to_numeric(result).astype('float64')
         return result
 
-    def clean_boolean_columns(self, col: pd.Series) -> pd.Series:
-        """ cleans up a boolean column"""
-        result = col.astype(str)
-        result = result.replace({'nan': 'false', 'True': 'true', 'False': 'false', '0': 'false', '1': 'true'})
+    def clean_numbers(self, col: pd.Series) -> pd.Series:
+        """ converts a number column read as text to float, the texts which are not numbers being null"""
+        if pd.api.types.is_numeric_dtype(col):
+            return col
+        result = pd.to_numeric(col, errors='coerce').astype('float64')
+        coerced = result.isna() & col.notna() & (col.astype(str).str.strip() != '')
+        if coerced.any():
+            o.print_warning(f'{col.name} : {coerced.sum()} values are not numbers and were left empty : '
+                            f'{", ".join(col[coerced].astype(str).unique()[:5])}')
         return result
 
+    def clean_boolean_columns(self, col: pd.Series) -> pd.Series:
+        """ cleans up a boolean column into native booleans, the empty cells being false"""
+        if pd.api.types.is_bool_dtype(col) and not col.hasnans:
+            return col.astype(bool)
+        return col.isin([True, 'True', 'true', '1'])
+
     def clean_categories(self, col: pd.Series) -> pd.Series:
         """ cleans up the categories by making them unified"""
         result: pd.Series
@@ -139,14 +301,13 @@ class FileLoader:
 
     def check_correct_date_format(self, col: pd.Series) -> pd.Series:
         """ verifies the columns"""
-        result = col.astype(str)
-        result = result.apply(lambda date_str: bool(re.match(r'\d{4}-\d{2}-\d{2}\s.+', date_str)))
+        result = col.astype(str).str.match(r'\d{4}-\d{2}-\d{2}\s.+')
         return result
 
     def parse_date(self, col: pd.Series) -> pd.Series:
         """ parses the column to a date"""
         result: pd.Series
-        result = pd.to_datetime(col, format='%Y-%m-%d', exact=True)
+        result = pd.to_datetime(col, format=schema.DATE_FORMAT, exact=True)
         return result
 
     def replace_zeroes_with_null(self, col: pd.Series) -> pd.Series:
@@ -164,10 +325,29 @@ class FileLoader:
         year = int(filename[-4:])
         return year
 
+    def get_present_columns(self, names) -> list:
+        """ the acceptable columns among the columns of an extract"""
+        return [c for c in names if c in self.__acceptables_columns]
+
+    def get_csv_options(self, csv_file: Path, text_numbers: bool = False) -> dict:
+        """ the read_csv options reading only the acceptable columns, with the types of the schema,
+        without type inference"""
+        usecols = self.get_present_columns(pd.read_csv(csv_file, nrows=0).columns)
+        columns = schema.get_columns(usecols)
+        # date_format needs pandas 2.0
+        return {'usecols': usecols, 'dtype': schema.get_read_dtypes(columns, text_numbers),
+                'parse_dates': schema.get_date_columns(columns), 'date_format': schema.DATE_FORMAT,
+                'engine': 'c'}
+
     def load_dataframe_from_csv(self, csv_file: Path) -> pd.DataFrame:
         if csv_file.suffix == '.csv':
             # this is a CSV, we can go for it
-            df = pd.read_csv(csv_file, parse_dates=True)
+            try:
+                df = pd.read_csv(csv_file, **self.get_csv_options(csv_file))
+            except ValueError:
+                # the extracts converted before the amounts were read as numbers hold '<amount> EUR' texts,
+                # and a number column, e.g. N°, may hold a text typed in the workbook
+                df = pd.read_csv(csv_file, **self.get_csv_options(csv_file, text_numbers=True))
 
             # extract the year
             year = self.get_fileyear(csv_file)
@@ -177,6 +357,49 @@ class FileLoader:
             # end
             return df
 
+    def read_arrow_table(self, extract_file: Path):
+        """ opens a columnar extract as an arrow table, restricted to the acceptable columns"""
+        # pyarrow is only needed for the columnar formats
+        if extract_file.suffix == '.feather':
+            from pyarrow import feather
+            # memory-mapped, the numeric columns are not copied while reading
+            table = feather.read_table(extract_file, memory_map=True)
+        elif extract_file.suffix == '.parquet':
+            from pyarrow import parquet
+            table = parquet.read_table(extract_file)
+        else:
+            raise ValueError(f'unknown extract format : {extract_file}')
+        # the other columns are never converted to pandas
+        return table.select(self.get_present_columns(table.column_names))
+
+    def load_dataframe(self, extract_file: Path) -> pd.DataFrame:
+        """ loads an extract, whatever its format. The columnar extracts keep their column types"""
+        if extract_file.suffix == '.csv':
+            return self.load_dataframe_from_csv(extract_file)
+        df = self.read_arrow_table(extract_file).to_pandas()
+        df['File Year'] = self.get_fileyear(extract_file)
+        return df
+
+    def iter_dataframe_chunks(self, extract_file: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+        """ reads an extract chunksize rows at a time, each chunk as load_dataframe would return it.
+        The amounts and the numbers of the csv extracts are read as texts, since the old '<amount> EUR' values
+        or a text number may show up in any chunk"""
+        if extract_file.suffix == '.csv':
+            chunks = pd.read_csv(extract_file, chunksize=chunksize,
+                                 **self.get_csv_options(extract_file, text_numbers=True))
+        else:
+            chunks = (b.to_pandas() for b in self.read_arrow_table(extract_file).to_batches(chunksize))
+
+        year = self.get_fileyear(extract_file)
+        for df in chunks:
+            df['File Year'] = year
+            yield df
+
+    def check_missing_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ Filters the dataframe over the rows missing a value the schema requires"""
+        required = [c.name for c in schema.get_columns(df.columns) if not c.nullable]
+        return df[df[required].isna().any(axis=1)]
+
     def check_wrong_dates_in_data_frame(self, df: pd.DataFrame) -> pd.DataFrame:
         """ Filters the dataframe over the wrong date columns """
         wrong_dates = self.check_correct_date_format(df['Date'])
@@ -188,57 +411,79 @@ class FileLoader:
         droppable_columns = [x for x in df.columns if x not in self.__acceptables_columns]
         return df.drop(columns=droppable_columns)
 
+    def get_column_cleanups(self) -> dict:
+        """ the cleanup of each column, following its parser in the schema.
+        The other columns are kept as they are"""
+        parsers = {'amount': self.replace_euros_in_column,
+                   'number': self.clean_numbers,
+                   'boolean': self.clean_boolean_columns,
+                   'date': self.parse_date,
+                   'category': self.clean_categories}
+        return {c.name: parsers[c.parser] for c in schema.COMPTES_COLUMNS if c.parser in parsers}
+
     def cleanup_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         """
             Cleans up the global data frame
             :param df: the data frame to be cleaned up
             :return: a cleaned up data frame
             """
-        df = self.keep_only_acceptable_columns(df)
-
-        # Then we convert to proper numeric types the Dépenses and Recettes
-        df['Dépense'] = self.replace_euros_in_column(df['Dépense'])
-        df['Recette'] = self.replace_euros_in_column(df['Recette'])
-        df['Provision à payer'] = self.replace_euros_in_column(df['Provision à payer'])
-        df['Provision à récupérer'] = self.replace_euros_in_column(df['Provision à récupérer'])
-
-        # Clean up the booleans
-        df['Economie'] = self.clean_boolean_columns(df['Economie'])
-        df['Réglé'] = self.clean_boolean_columns(df['Réglé'])
-
-        # Clean up the dates
-        df = df[df['Date'] != '9999-12-31']
-        df['Date'] = self.parse_date(df['Date'])
-
-        # clean up the month
-        df['Mois'] = self.parse_date(df['Mois'])
-
-        # clean up the catégories
-        df['Catégorie'] = self.clean_categories(df['Catégorie'])
-
-        # Add a date checker column
-        df['Date Out of Bound'] = df['Date'].dt.year > df['File Year']
-
-        # Calculate the provision à récupérer
-        df.reset_index(drop=True, inplace=True)
-        df.loc[~df['Taux de remboursement'].isna(), 'Provision à récupérer'] = df['Dépense'] * df[
-            'Taux de remboursement']
-
-        # Rename the columns
-        df.rename(columns={'N°': 'No', 'N° de référence': 'no_de_reference', 'Fait Marquant': 'fait_marquant',
-                           'Taux de remboursement': 'taux_remboursement'}, inplace=True)
+        with instrumentation.span('cleanup', len(df)):
+            # the rows and the columns are selected once, then each column is cleaned up on its own
+            # and the cleaned columns make up the new data frame, without copying the whole frame in between
+            keep = (df['Date'] != '9999-12-31').to_numpy()
+            index = pd.RangeIndex(keep.sum())
+            cleanups = self.get_column_cleanups()
+            columns = {}
+            for name in df.columns:
+                if name in self.__acceptables_columns:
+                    col = df[name].iloc[keep].set_axis(index, copy=False)
+                    if name in cleanups:
+                        with instrumentation.span(name, len(col)):
+                            col = cleanups[name](col)
+                    columns[name] = col
+            df = pd.DataFrame(columns, index=index)
+
+            # Add a date checker column
+            with instrumentation.span('Date Out of Bound', len(df)):
+                df['Date Out of Bound'] = df['Date'].dt.year > df['File Year']
+
+            # Calculate the provision à récupérer
+            with instrumentation.span('Provision à récupérer', len(df)):
+                refunded = df['Taux de remboursement'].notna()
+                df.loc[refunded, 'Provision à récupérer'] = df['Dépense'] * df['Taux de remboursement']
+
+            # Rename the columns
+            df.rename(columns=schema.get_renames(), inplace=True)
 
         return df
 
-    def save_dataframe_to_sql(self, df: pd.DataFrame) -> int:
+    def save_dataframe_to_sql(self, df: pd.DataFrame | Iterable[pd.DataFrame], delta: bool = False) -> int:
         """
-        Save the data frame to the PostGres database
+        Save the data frame, or the data frames of an iterable, to the PostGres database
+        :param delta: False to replace the whole table,
+            True to replace only the File Years found in the data frame
+        :return: the number of rows inserted
         """
 
-        rows = load_to_table('comptes', df)
-        rows = get_row_count('comptes')
+        sink = DatabaseSink()
+        if delta:
+            rows = sink.replace_partitions(self.__table_comptes__, df, 'File Year')
+        else:
+            rows = sink.replace_table(self.__table_comptes__, df)
         return rows
 
+    def append_dataframe_to_sql(self, df: pd.DataFrame | Iterable[pd.DataFrame], watermark_column: str,
+                                watermark) -> int:
+        """
+        Append the data frame, or the data frames of an iterable, to the PostGres database.
+        The rows already loaded from the watermark on are replaced
+        :return: the number of rows inserted
+        """
+        return DatabaseSink().replace_from(self.__table_comptes__, df, watermark_column, watermark)
+
+    def get_max_value_in_sql(self, column_name: str):
+        return DatabaseSink().get_max_value(self.__table_comptes__, column_name)
+
     def save_dataframe_to_csv(self, df: pd.DataFrame, filename: str, append_timestamp: bool) -> bool:
         """
         Save the dataframe to a CSV file in my home folder
@@ -257,60 +502,106 @@ class FileLoader:
         return True
 
 
-def stage():
+def stage(force: bool = False):
     o.print_title("Starting Finance Extractor...")
 
     o.print_title("Staging")
     fs = FileStager()
-    ct = fs.sweep_and_push(Path.home().joinpath('Bureau'), '^Comptes.*ods$', fs.get_staging_folder())
+    ct = fs.sweep_and_push(Path.home().joinpath('Bureau'), '^Comptes.*ods$', fs.get_staging_folder(), force)
     o.print_event(f'{ct} files found and pushed to the staging area')
 
 
-def convert():
+def convert_file(p: Path, extract_format: str = 'csv') -> int:
+    """ converts one account file and saves its extract. Runs in a worker process
+    :return: the number of rows converted"""
+    fc = FileConverter()
+    # calling the read method
+    o.print_event(f'extracting the file : {p}')
+    df = fc.convert_account_file(p)
+    o.print_event(f'dataframe created')
+    o.print_debug('columns : %s', df.columns)
+    o.print_event(f'rows : {len(df)}')
+    # save the dataframe
+    fc.save_dataframe(df, p.stem, extract_format)
+    o.print_event('Output saved')
+    return len(df)
+
+
+def convert(workers: int = None, force: bool = False, extract_format: str = 'csv') -> int:
+    """ converts the staged files across a pool of processes.
+    A file failing to convert is reported and does not stop the others
+
+    :param workers: the number of processes, None for one per core. 1 converts in the current process
+    :param force: True to convert all the files, False to convert only the new or changed ones
+    :param extract_format: the format of the extracts, one of csv, feather, parquet
+    :return: the number of files converted"""
     o.print_title("Iterating over the source files")
     fs = FileStager()
-    files = fs.get_source_files()
+    fc = FileConverter()
+    manifest = FileManifest()
+    files = sorted(fs.get_source_files())
     o.print_event(f'{len(files)} files found')
+    if not force:
+        files = [p for p in files
+                 if manifest.is_changed('convert', p, fc.get_extract_path(p.stem, extract_format))]
+        o.print_event(f'{len(files)} files new or changed')
 
     # iterate over each file
-    fc = FileConverter()
+    results = {}
     p: Path
-    df: pd.DataFrame
-    for p in files:
-        # calling the read method
-        o.print_event(f'extracting the file : {p}')
-        df = fc.convert_account_file(p)
-        o.print_event(f'dataframe created')
-        o.print_event(f'columns : {df.columns}')
-        o.print_event(f'rows : {len(df)}')
-        # save the dataframe
-        fc.save_dataframe(df, p.stem)
-        o.print_event('Output saved')
+    if workers == 1:
+        for p in files:
+            with instrumentation.span(p.name) as s:
+                try:
+                    results[p] = convert_file(p, extract_format)
+                    s.add_rows(results[p])
+                except Exception as e:
+                    results[p] = e
+    else:
+        # each file is timed in its worker, and its span added up here
+        trace_memory = instrumentation.is_tracing_memory()
+        profile = instrumentation.get_profile()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {p: executor.submit(instrumentation.call_in_span, p.name, trace_memory,
+                                          convert_file, p, extract_format, **profile) for p in files}
+            for p, future in futures.items():
+                try:
+                    results[p], summary = future.result()
+                    instrumentation.attach(summary, results[p])
+                except Exception as e:
+                    results[p] = e
+
+    # report in the order of the files
+    o.print_title('Conversion results')
+    converted = 0
+    for p, result in results.items():
+        if isinstance(result, Exception):
+            o.print_warning(f'{p.name} : conversion failed : {type(result).__name__} {result}')
+        else:
+            o.print_event(f'{p.name} : {result} rows converted')
+            manifest.record('convert', p, fc.get_extract_path(p.stem, extract_format))
+            converted += 1
+    manifest.save()
+    o.print_event(f'{converted} files converted, {len(files) - converted} failed')
+    return converted
 
 
-def load_files_without_clean() -> pd.DataFrame:
+def load_files_without_clean(extract_format: str = 'csv') -> pd.DataFrame:
     o.print_title('Loading files')
     fc = FileConverter()
     o.print_event(f'* scanning folder : {fc.get_extract_folder()}')
     files = fc.get_converted_files()
-    files = [f for f in files if f.suffix == '.csv']
+    files = [f for f in files if f.suffix == fc.get_extract_suffix(extract_format)]
     o.print_event(f'{len(files)} files found')
 
-    # define acceptable columns
-    acceptable_columns = ('Catégorie', 'Compte', 'Date', "Date d'insertion",
-                          'Description', 'Dépense', 'Economie',
-                          'File Year', 'Mois', 'Recette', 'Réglé',
-                          'Provision à payer', 'Provision à récupérer',
-                          'Date remboursement', 'Organisme')
-
-    fl = FileLoader(acceptable_columns)
+    fl = FileLoader(schema.get_column_names())
     p: Path
     df: pd.DataFrame
     dataframes = []
     for p in files:
         o.print_event(f'loading file : {p}')
         # load the dataframe
-        df = fl.load_dataframe_from_csv(p)
+        df = fl.load_dataframe(p)
         o.print_event(f'file loaded : {len(df)} rows')
         dataframes.append(df)
 
@@ -323,29 +614,92 @@ def load_files_without_clean() -> pd.DataFrame:
     return global_df
 
 
-def load():
+def load_chunks(fl: FileLoader, files: list, chunksize: int, delta: bool) -> bool:
+    """ loads the extracts chunksize rows at a time. Each chunk is read, cleaned up and written
+    before the next one is read, so the memory used depends on the chunk size, not on the history.
+    The dates of all the files are checked first, reading only their Date column
+    :return: True when the files were loaded, False when wrong dates were found"""
+    o.print_event(f'checking the date formats...')
+    date_loader = FileLoader(('Date',))
+    missing_values = 0
+    wrong_dates = []
+    with instrumentation.span('check dates'):
+        for p in files:
+            for chunk in date_loader.iter_dataframe_chunks(p, chunksize):
+                missing_values += len(date_loader.check_missing_values(chunk))
+                wrong_dates.append(date_loader.check_wrong_dates_in_data_frame(chunk))
+    if missing_values > 0:
+        o.print_warning(f'{missing_values} rows missing a required value')
+    wrong_dates = pd.concat(wrong_dates) if len(wrong_dates) > 0 else []
+    if len(wrong_dates) > 0:
+        o.print_warning(f'wrong dates found !')
+        o.print_warning(wrong_dates[['Date', 'File Year']])
+        return False
+
+    def generate_chunks() -> Iterator[pd.DataFrame]:
+        # the index runs across the chunks, as it does across the merged dataframe
+        offset = 0
+        for f in files:
+            o.print_event(f'loading file : {f}')
+            chunks = fl.iter_dataframe_chunks(f, chunksize)
+            while True:
+                # the reading and the cleanup of each chunk are timed under its file,
+                # the span is closed before the chunk is handed over to the database
+                with instrumentation.span(f.name) as s:
+                    df = next(chunks, None)
+                    if df is not None:
+                        s.add_rows(len(df))
+                        df = fl.cleanup_dataframe(df)
+                if df is None:
+                    break
+                df.index += offset
+                offset += len(df)
+                yield df
+
+    with instrumentation.span('save') as s:
+        loaded_rows = fl.save_dataframe_to_sql(generate_chunks(), delta)
+        s.add_rows(loaded_rows)
+    o.print_event(f'dataframe loaded : {loaded_rows} loaded')
+    return True
+
+
+def load(extract_format: str = 'csv', delta: bool = False, chunksize: int = None):
+    """ loads the extracts into the database
+    :param extract_format: the format of the extracts, one of csv, feather, parquet
+    :param delta: True to load only the extracts changed since the last load, replacing their File Years
+    :param chunksize: None to merge the extracts in memory before loading them,
+        a number of rows to stream the extracts into the database chunk by chunk
+    """
     o.print_title('Loading files')
     fc = FileConverter()
+    manifest = FileManifest()
     o.print_event(f'* scanning folder : {fc.get_extract_folder()}')
     files = fc.get_converted_files()
-    files = [f for f in files if f.suffix == '.csv']
+    files = [f for f in files if f.suffix == fc.get_extract_suffix(extract_format)]
     o.print_event(f'{len(files)} files found')
+    if delta:
+        files = [p for p in files if manifest.is_changed('load', p, p)]
+        o.print_event(f'{len(files)} files new or changed since the last load')
+
+    fl = FileLoader(schema.get_column_names())
+    if chunksize is not None:
+        if len(files) == 0:
+            o.print_event(f'no dataframes found')
+        elif load_chunks(fl, files, chunksize, delta):
+            for p in files:
+                manifest.record('load', p, p)
+            manifest.save()
+        return
 
-    # define acceptable columns
-    acceptable_columns = ('Date', 'N°', 'Description', 'Dépense', 'N° de référence', 'Recette',
-                          'Taux de remboursement', 'Compte', 'Catégorie',
-                          'Economie', 'Réglé', 'Mois', "Date d'insertion",
-                          'Provision à payer', 'Provision à récupérer',
-                          'Date remboursement', 'Organisme', 'Fait Marquant', 'File Year')
-
-    fl = FileLoader(acceptable_columns)
     p: Path
     df: pd.DataFrame
     dataframes = []
     for p in files:
         o.print_event(f'loading file : {p}')
         # load the dataframe
-        df = fl.load_dataframe_from_csv(p)
+        with instrumentation.span(p.name) as s:
+            df = fl.load_dataframe(p)
+            s.add_rows(len(df))
         o.print_event(f'file loaded : {len(df)} rows')
         dataframes.append(df)
 
@@ -355,35 +709,90 @@ def load():
         global_df = pd.concat(dataframes)
         o.print_event(f'dataframes merged : {len(global_df)} rows in total')
         o.print_event(f'checking the date formats...')
-        wrong_dates = fl.check_wrong_dates_in_data_frame(global_df)
+        with instrumentation.span('check dates', len(global_df)):
+            missing_values = fl.check_missing_values(global_df)
+            wrong_dates = fl.check_wrong_dates_in_data_frame(global_df)
+        if len(missing_values) > 0:
+            o.print_warning(f'{len(missing_values)} rows missing a required value')
         if len(wrong_dates) > 0:
-            o.print_event(f'wrong dates found !')
-            o.print_event(wrong_dates[['Date', 'File Year']])
+            o.print_warning(f'wrong dates found !')
+            o.print_warning(wrong_dates[['Date', 'File Year']])
         else:
             global_df = fl.cleanup_dataframe(global_df)
             o.print_event(f'global dataframe cleaned up')
-            loaded_rows = fl.save_dataframe_to_sql(global_df)
+            with instrumentation.span('save', len(global_df)):
+                loaded_rows = fl.save_dataframe_to_sql(global_df, delta)
             o.print_event(f'dataframe loaded : {loaded_rows} loaded')
+            for p in files:
+                manifest.record('load', p, p)
+            manifest.save()
     else:
         o.print_event(f'no dataframes found')
 
 
-def load_from_sqlite():
+def needs_conversion(p: Path, extract_format: str = 'csv') -> bool:
+    """ checks if the staged workbook changed since its last conversion"""
+    return FileManifest().is_changed('convert', p, FileConverter().get_extract_path(p.stem, extract_format))
+
+
+def load_workbook(p: Path, extract_format: str = 'csv') -> int:
+    """ records the conversion of a single workbook and replaces its File Year in the database
+    with its extract, when the extract changed since its last load
+    :return: the number of rows loaded"""
+    manifest = FileManifest()
+    extract = FileConverter().get_extract_path(p.stem, extract_format)
+    if manifest.is_changed('convert', p, extract):
+        manifest.record('convert', p, extract)
+        manifest.save()
+    if not manifest.is_changed('load', extract, extract):
+        o.print_event(f'* file unchanged, skipped')
+        return 0
+
+    fl = FileLoader(schema.get_column_names())
+    df = fl.load_dataframe(extract)
+    wrong_dates = fl.check_wrong_dates_in_data_frame(df)
+    if len(wrong_dates) > 0:
+        o.print_warning(f'wrong dates found !')
+        o.print_warning(wrong_dates[['Date', 'File Year']])
+        return 0
+    loaded_rows = fl.save_dataframe_to_sql(fl.cleanup_dataframe(df), delta=True)
+    o.print_event(f'dataframe loaded : {loaded_rows} loaded')
+    manifest.record('load', extract, extract)
+    manifest.save()
+    return loaded_rows
+
+
+def update_workbook(p: Path, extract_format: str = 'csv') -> int:
+    """ converts a single staged workbook and replaces its File Year in the database,
+    instead of converting and loading all the workbooks
+    :return: the number of rows loaded"""
+    o.print_title(f'Updating {p.name}')
+    if needs_conversion(p, extract_format):
+        convert_file(p, extract_format)
+    return load_workbook(p, extract_format)
+
+
+def load_from_sqlite(chunksize: int = 10000, watermark_column: str = None):
+    """ migrates the transactions of the SQLite database to the Postgres one, chunksize rows at a time.
+    The next chunk is read while the current one is written
+    :param watermark_column: None to replace the whole table, a column such as Date d'insertion
+        to append only the rows at or above the highest value already migrated, replacing those on it
+    """
     o.print_title('Loading from SQLite database')
     dc = DatabaseConverter()
-    o.print_event('Retrieving the SQLite content')
-    df = dc.get_transactions()
-    o.print_event('Loading to Postgres Database')
-    # define acceptable columns
-    acceptable_columns = ('Date', 'Description', 'Recette', 'Dépense',
-                          'Compte', 'Catégorie', 'Economie', 'Réglé',
-                          'Mois', "Date d'insertion", 'File Year',
-                          'Provision à payer', 'Provision à récupérer',
-                          'Date remboursement', 'Organisme', 'Date Out of Bound',
-                          'taux_remboursement', 'fait_marquant', 'No',
-                          'no_de_reference')
-
-    fl = FileLoader(acceptable_columns)
-
-    loaded_rows = fl.save_dataframe_to_sql(df)
+    # the database holds the columns under their loaded names
+    fl = FileLoader(schema.get_loaded_column_names())
+    watermark = None
+    if watermark_column is not None:
+        watermark = fl.get_max_value_in_sql(watermark_column)
+        o.print_event(f'watermark : {watermark_column} from {watermark}')
+    o.print_event('Streaming the SQLite content to Postgres Database')
+    chunks = prefetch(dc.iter_transactions(chunksize, watermark_column, watermark))
+
+    with instrumentation.span('save') as s:
+        if watermark_column is None:
+            loaded_rows = fl.save_dataframe_to_sql(chunks)
+        else:
+            loaded_rows = fl.append_dataframe_to_sql(chunks, watermark_column, watermark)
+        s.add_rows(loaded_rows)
     o.print_event(f'dataframe loaded : {loaded_rows} loaded')
@@ -1,21 +1,249 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import CancelledError
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
 from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
 from finance.finance_extractor import FileStager
-from finance.finance_extractor import load
-from finance.finance_extractor import convert
+from finance.finance_extractor import convert_file
+from finance.finance_extractor import load_workbook
+from finance.finance_extractor import needs_conversion
+from finance.finance_extractor import update_workbook
 from pathlib import Path
 import finance.output as o
 
+
 class ComptesModifiedHandler(FileSystemEventHandler):
+    """ Updates a workbook once its events settled.
+    A single save from the office suite fires several events (temporary file, rename, lock file):
+    they are merged per workbook, and only the workbook that changed is converted and reloaded"""
+    __settle_delay__: float
+    __update__: Callable
+    __timers__: dict
+    __lock__: threading.Lock
+    __update_lock__: threading.Lock
+
+    def __init__(self, settle_delay: float = 2.0, update: Callable[[Path], int] = update_workbook):
+        """
+        :param settle_delay: the seconds without event on a workbook before it is updated
+        :param update: the update run for each settled workbook
+        """
+        super().__init__()
+        self.__settle_delay__ = settle_delay
+        self.__update__ = update
+        self.__timers__ = {}
+        self.__lock__ = threading.Lock()
+        self.__update_lock__ = threading.Lock()
+
+    def is_workbook(self, p: Path) -> bool:
+        """ the lock files (.~lock.*#) and the temporary files (*.tmp, *.ods~) are not workbooks"""
+        return FileStager().is_valid_file(p.name) and p.suffix == '.ods'
+
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_moved(self, event):
+        # the office suite saves into a temporary file, then renames it to the workbook
+        if not event.is_directory:
+            self.schedule(Path(event.dest_path))
+
     def on_modified(self, event):
         if not event.is_directory:
-            filename = event.src_path
-            fs = FileStager()
-            p = Path(filename)
-            if fs.is_valid_file(p.name):
-                o.print_event(f'Fichier Modifié : {p.name}')
-                o.print_title('starting conversion')
-                convert()
-                print('starting loading')
-                load()
+            self.schedule(Path(event.src_path))
+
+    def schedule(self, p: Path):
+        """ (re)starts the settle delay of the workbook"""
+        if not self.is_workbook(p):
+            return
+        with self.__lock__:
+            timer = self.__timers__.get(p)
+            if timer is not None:
+                timer.cancel()
             else:
-                o.print_event(f'Invalid File : {event.src_path}')
+                o.print_event(f'Fichier Modifié : {p.name}')
+            timer = threading.Timer(self.__settle_delay__, self.process, [p])
+            timer.daemon = True
+            self.__timers__[p] = timer
+            timer.start()
+
+    def process(self, p: Path):
+        with self.__lock__:
+            # a new event may have restarted the delay in the meantime
+            if self.__timers__.get(p) is threading.current_thread():
+                del self.__timers__[p]
+        if not p.exists():
+            return
+        # one update at a time, the workbooks share the manifest and the database
+        with self.__update_lock__:
+            try:
+                self.__update__(p)
+            except Exception as e:
+                o.print_warning(f'{p.name} : update failed : {type(e).__name__} {e}')
+
+    def get_pending(self) -> list:
+        """ the workbooks waiting for their events to settle"""
+        with self.__lock__:
+            return list(self.__timers__)
+
+    def cancel_pending(self) -> list:
+        """ cancels the updates of the workbooks waiting for their events to settle, e.g. when stopping
+        :return: the workbooks cancelled"""
+        with self.__lock__:
+            result = list(self.__timers__)
+            for timer in self.__timers__.values():
+                timer.cancel()
+            self.__timers__.clear()
+        return result
+
+
+class ListenerRuntime:
+    """ Runs the listener on an asyncio loop.
+    The settled workbooks go through a bounded queue to a dispatcher, which converts them on a pool
+    of processes and loads them one at a time. A workbook has at most one job at a time,
+    the saves arriving meanwhile give a single new job once it is over"""
+    needs_conversion = staticmethod(needs_conversion)
+    convert_file = staticmethod(convert_file)
+    load_workbook = staticmethod(load_workbook)
+
+    __folder__: Path
+    __workers__: int
+    __settle_delay__: float
+    __queue_size__: int
+    __extract_format__: str
+    __executor__: Executor
+    __status__: dict
+    __queue__: asyncio.Queue
+    __semaphore__: asyncio.Semaphore
+    __lock__: asyncio.Lock
+    __rerun__: set
+    __jobs__: set
+    __stopping__: bool
+
+    def __init__(self, folder: Path, workers: int = None, settle_delay: float = 2.0, queue_size: int = 100,
+                 extract_format: str = 'csv', executor: Executor = None):
+        """
+        :param folder: the folder watched, the staging folder
+        :param workers: the number of workbooks processed at the same time, None for one per core
+        :param settle_delay: the seconds without event on a workbook before it is processed
+        :param queue_size: the workbooks waiting for a worker, the watcher waits beyond that
+        :param extract_format: the format of the extracts, one of csv, feather, parquet
+        :param executor: the executor converting the workbooks, a pool of processes by default
+        """
+        self.__folder__ = folder
+        self.__workers__ = workers or os.cpu_count() or 1
+        self.__executor__ = ProcessPoolExecutor(max_workers=self.__workers__) if executor is None else executor
+        self.__settle_delay__ = settle_delay
+        self.__queue_size__ = queue_size
+        self.__extract_format__ = extract_format
+        # the queue, the semaphore and the lock belong to the loop of run, they are created there
+        self.__queue__ = None
+        self.__semaphore__ = None
+        self.__lock__ = None
+        self.__rerun__ = set()
+        self.__jobs__ = set()
+        self.__stopping__ = False
+        self.__status__ = {'running': [], 'processed': 0, 'failed': 0, 'rows': 0,
+                           'last_workbook': None, 'last_latency': None}
+
+    def get_status(self) -> dict:
+        """ the status of the listener : the workbooks queued and running, the jobs processed and failed,
+        the rows loaded and the seconds from the last settled save to its load"""
+        return dict(self.__status__, running=list(self.__status__['running']),
+                    queued=0 if self.__queue__ is None else self.__queue__.qsize())
+
+    def print_status(self):
+        s = self.get_status()
+        o.print_event(f"listener : {s['processed']} processed, {s['failed']} failed, {s['rows']} rows loaded, "
+                      f"{len(s['running'])} running, {s['queued']} queued")
+
+    async def run(self, stop: asyncio.Event = None):
+        """ watches the folder until stop is set or the task is cancelled"""
+        loop = asyncio.get_running_loop()
+        self.__queue__ = asyncio.Queue(self.__queue_size__)
+        self.__semaphore__ = asyncio.Semaphore(self.__workers__)
+        self.__lock__ = asyncio.Lock()
+        self.__rerun__ = set()
+        self.__jobs__ = set()
+        self.__stopping__ = False
+
+        def submit(p: Path):
+            # called from the timer threads of the handler, waits while the queue is full
+            if self.__stopping__:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self.__queue__.put((p, time.monotonic())), loop).result()
+            except (RuntimeError, CancelledError):
+                # the loop stopped meanwhile, the workbook is dropped with the queued ones
+                pass
+
+        handler = ComptesModifiedHandler(self.__settle_delay__, submit)
+        observer = Observer()
+        observer.schedule(handler, path=str(self.__folder__), recursive=False)
+        observer.start()
+        dispatcher = asyncio.create_task(self.dispatch())
+        o.print_event(f'listening to {self.__folder__} with {self.__workers__} workers')
+        try:
+            await (asyncio.Event() if stop is None else stop).wait()
+        finally:
+            self.__stopping__ = True
+            observer.stop()
+            await asyncio.to_thread(observer.join)
+            handler.cancel_pending()
+            dispatcher.cancel()
+            if len(self.__jobs__) > 0:
+                # the running jobs are completed, the queued ones are dropped
+                await asyncio.wait(self.__jobs__)
+            self.__executor__.shutdown()
+            self.print_status()
+
+    async def dispatch(self):
+        while True:
+            p, submitted = await self.__queue__.get()
+            if p in self.__status__['running']:
+                self.__rerun__.add(p)
+                continue
+            # waits for a free worker, the queue fills up meanwhile
+            await self.__semaphore__.acquire()
+            self.__status__['running'].append(p)
+            job = asyncio.create_task(self.update(p, submitted))
+            self.__jobs__.add(job)
+            job.add_done_callback(self.__jobs__.discard)
+
+    async def update(self, p: Path, submitted: float):
+        loop = asyncio.get_running_loop()
+        try:
+            # the manifest and the tables are shared, their steps run one at a time
+            async with self.__lock__:
+                changed = await asyncio.to_thread(self.needs_conversion, p, self.__extract_format__)
+            if changed:
+                await loop.run_in_executor(self.__executor__, self.convert_file, p, self.__extract_format__)
+            async with self.__lock__:
+                rows = await asyncio.to_thread(self.load_workbook, p, self.__extract_format__)
+            self.__status__['processed'] += 1
+            self.__status__['rows'] += rows
+            self.__status__['last_workbook'] = p.name
+            self.__status__['last_latency'] = time.monotonic() - submitted
+        except Exception as e:
+            self.__status__['failed'] += 1
+            o.print_warning(f'{p.name} : update failed : {type(e).__name__} {e}')
+        finally:
+            self.__status__['running'].remove(p)
+            self.__semaphore__.release()
+            if p in self.__rerun__:
+                self.__rerun__.discard(p)
+                self.requeue(p)
+            self.print_status()
+
+    def requeue(self, p: Path):
+        """ queues the workbook again for the saves that arrived during its job, unless the listener stops.
+        The job does not wait for room in the queue: the dispatcher taking from it may be cancelled"""
+        if self.__stopping__:
+            return
+        try:
+            self.__queue__.put_nowait((p, time.monotonic()))
+        except asyncio.QueueFull:
+            o.print_warning(f'{p.name} : queue full, its last save is processed with its next one')
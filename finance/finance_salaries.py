@@ -4,14 +4,57 @@ from pathlib import Path
 import pandas as pd
 import finance.ods_io as ods_io
 
-from finance.database import load_to_table
-from finance.database import get_row_count
+from finance.database import DatabaseSink
+import sqlalchemy as sqla
+import numpy as np
 import re
+import datetime as dt
 import finance.output as o
 
+# the month headers written as texts, e.g. 01/01/23
+MONTH_HEADER = re.compile(r'[0-9]{2}/[0-9]{2}/[0-9]{2}')
+# the column of the former layout of the salaries table, which held valeur as a text next to its number
+# and mois as a dd/mm/yy text. That table is migrated in place by the next load, see save_dataframe_to_sql
+LEGACY_COLUMN = 'Valeur Numérique'
+# the column of the data frame index, loaded by the former full loads only. The salaries are identified
+# by their keys and the full and delta loads write the same columns, without the index
+INDEX_COLUMN = 'index'
+
+
+def to_amounts(values: pd.Series) -> np.ndarray:
+    """ converts the typed cell values of a month column to float64. The numbers and currencies are kept,
+    the empty cells are NaN and only the cells holding texts are parsed, as amounts in the french format,
+    e.g. 2.500,00 €"""
+    if pd.api.types.is_float_dtype(values):
+        return values.to_numpy(dtype='float64')
+    is_text = values.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    result = pd.to_numeric(values.where(~is_text), errors='coerce').to_numpy(dtype='float64')
+    if is_text.any():
+        texts = values[is_text].astype(str).str.replace(' €', '', regex=False).str.replace('.', '', regex=False) \
+            .str.replace(',', '.', regex=False).str.strip()
+        result[is_text] = pd.to_numeric(texts.where(texts != '')).to_numpy(dtype='float64')
+    return result
+
+
+def to_month(header) -> pd.Timestamp:
+    """ the month of a header : a date cell, or a dd/mm/yy or dd/mm/yyyy text. None for the other headers"""
+    if isinstance(header, pd.Timestamp):
+        return header
+    if not isinstance(header, str) or not MONTH_HEADER.match(header):
+        return None
+    for month_format in ('%d/%m/%y', '%d/%m/%Y'):
+        try:
+            return pd.Timestamp(dt.datetime.strptime(header, month_format))
+        except ValueError:
+            pass
+    return None
+
+
 class SalaryExtractor:
     __root_folder__ = 'Comptes'
     __salary_sheet__ = 'Salaires'
+    __salary_table__ = 'salaires'
+    __salary_keys__ = ['categorie', 'poste', 'mois']
     """ This class is dedicated to salary extraction"""
 
     def get_source_file(self) -> Path:
@@ -23,80 +66,113 @@ class SalaryExtractor:
     def get_spreadsheet(self, source_file: Path) -> ods_io.SpreadsheetWrapper:
         """ This class converts an account file"""
         sh = ods_io.SpreadsheetWrapper()
-        sh.load(source_file)
+        # only the salary sheet is parsed
+        sh.load(source_file, [self.__salary_sheet__])
         return sh
 
     def get_salary_sheet(self, wkb: ods_io.SpreadsheetWrapper) -> ods_io.SheetWrapper:
-        sh = wkb.get_sheets()['Salaires']
+        sh = wkb.get_sheets()[self.__salary_sheet__]
         return sh
 
-    def parse_salary_sheet(self, sheet: ods_io.SheetWrapper) -> list:
-        """ This method parses the salary sheet and converts it to a table with
-        Item
-        Month
-        Value"""
+    def get_salary_block(self, sheet: ods_io.SheetWrapper) -> pd.DataFrame:
+        """ reads the typed values of the salary sheet once into a block of amounts, with the categorie
+        and poste columns followed by one float64 column per month, named after the month date
+
+        :param sheet: the salary sheet, the month headers being on its third row
+        :return: the block, one row per item"""
         pivot_x = 2
         pivot_y = 1
-        o.print_event(f'setting up the pivot cell : ({pivot_x}, {pivot_y})')
-
-        # parse the dates
-        o.print_event('retrieving the header row')
-        date_row = ods_io.RowWrapper()
-        date_row.element = sheet.get_row(pivot_x)
-        o.print_event(f'header row retrieved : {date_row.get_cell_count()} found')
-        # SELECT THE DATES
-        dates = date_row.get_values()
-        o.print_event(f'values retrieved : {len(dates)} found')
-
-        # find the first column
-        o.print_event('searching for the first date-like header')
+
+        # the typed values, the currencies are numbers and the date headers timestamps
+        values = sheet.to_dataframe(header_row=pivot_x)
+        headers = list(values.columns)
+
+        # the month headers are the dd/mm/yy texts or the date cells, from the first one on.
+        # The columns past the last month are left out
+        header_months = [to_month(h) for h in headers]
         y_start = 0
-        while not re.match('[0-9]{2}\/[0-9]{2}\/[0-9]{2}', dates[y_start]):
-            o.print_event(dates[y_start])
+        while y_start < len(headers) and header_months[y_start] is None:
             y_start += 1
-        o.print_event(f'first date-like header found at position {y_start}')
-
-        months = dates[y_start:]
-        month_length = len(months)
-        o.print_event(f'number of months : {month_length}')
-
-        # parse the content
-        rw = ods_io.RowWrapper()
-        row_num = sheet.get_row_count()
-        o.print_event(f'sheet opened, number of rows : {row_num}')
-        result = []
-        # iterate over the rows
-        for i in range(row_num):
-            o.print_event(f'reading row {i}')
-            rw.element = sheet.get_row(i)
-            values = rw.get_values()
-            count_values = len(values)
-            o.print_event(f'{count_values} rows found')
-            if len(values) > pivot_y:
-                header = values[pivot_y]
-                category = values[pivot_y-1]
-                o.print_event(f'header found : {header}, category : {category}')
-                if header != '':
-                    for j in range(y_start,count_values):
-                        if j < len(values):
-                            result += [[category, header, dates[j], str(values[j]).replace(' €', '')]]
-
-                    print(f'{len(values)} found')
+        month_columns = [j for j in range(y_start, len(headers)) if header_months[j] is not None]
+        months = pd.DatetimeIndex([header_months[j] for j in month_columns])
+        o.print_event(f'first month header found at position {y_start}, number of months : {len(months)}')
+
+        # the items are the rows below the headers with a poste
+        poste = values.iloc[:, pivot_y]
+        items = values[(poste.notna() & (poste != '')).to_numpy()]
+        o.print_event(f'sheet read, number of items : {len(items)}')
+
+        # the amounts are converted in one pass, the block being flattened
+        block = items.iloc[:, month_columns]
+        amounts = to_amounts(pd.Series(block.to_numpy(dtype='object').ravel(), dtype='object'))
+        result = pd.DataFrame(amounts.reshape(len(items), len(months)), columns=months)
+        # the empty categories stay empty texts, they are part of the key of the salaries
+        result.insert(0, 'categorie', items.iloc[:, pivot_y - 1].fillna('').to_numpy())
+        result.insert(1, 'poste', items.iloc[:, pivot_y].to_numpy())
         return result
 
-    def convert_salaries_to_dataframe(self, salaries:list) -> pd.DataFrame:
-        o.print_event('creating the salaries dataframe')
-        df = pd.DataFrame(salaries, columns=['categorie', 'poste', 'mois', 'valeur'])
-        o.print_event('converting the valeur to a numeric value')
-        df['Valeur Numérique'] = df['valeur'].replace('\.', '', regex=True).replace(',', '.', regex=True)
-        df['Valeur Numérique'] = pd.to_numeric(df['Valeur Numérique'])
-        o.print_event('conversion done')
+    def parse_salary_sheet(self, sheet: ods_io.SheetWrapper) -> pd.DataFrame:
+        """ This method parses the salary sheet and unpivots it to a table with
+        categorie
+        poste
+        mois, the date of the month
+        valeur, the amount. The empty cells are left out"""
+        block = self.get_salary_block(sheet)
+        amounts = block.iloc[:, 2:].to_numpy()
+        items, months = amounts.shape
+        # melt the block month by month : the items are repeated for each month
+        df = pd.DataFrame({'categorie': np.tile(block['categorie'].to_numpy(), months),
+                           'poste': np.tile(block['poste'].to_numpy(), months),
+                           'mois': np.repeat(pd.DatetimeIndex(block.columns[2:]).to_numpy(), items),
+                           'valeur': amounts.ravel(order='F')})
+        df = df[df['valeur'].notna()].reset_index(drop=True)
+        o.print_event(f'{len(df)} values found')
         return df
 
-    def save_dataframe_to_sql(self, df: pd.DataFrame) -> int:
+    def convert_salaries_to_dataframe(self, salaries: list | pd.DataFrame) -> pd.DataFrame:
+        """ kept for the callers of the former API, where parse_salary_sheet returned a list of
+        [categorie, poste, mois, valeur] texts. parse_salary_sheet now returns the data frame itself
+
+        :param salaries: the data frame of parse_salary_sheet, returned as it is, or the former list of texts
+        :return: the salaries with mois as a date and valeur as a number, the empty values being left out"""
+        if isinstance(salaries, pd.DataFrame):
+            return salaries
+        df = pd.DataFrame(salaries, columns=['categorie', 'poste', 'mois', 'valeur'], dtype='object')
+        df['mois'] = pd.to_datetime(df['mois'].map(to_month))
+        df['valeur'] = to_amounts(df['valeur'])
+        return df[df['valeur'].notna()].reset_index(drop=True)
+
+    def migrate_legacy_table(self, sink: DatabaseSink) -> bool:
+        """ migrates the former layouts of the salaries table in place, in a single transaction:
+        valeur takes the numbers of Valeur Numérique, mois the dates of its dd/mm/yy texts
+        and Valeur Numérique is dropped. The index column loaded by the former full loads is dropped as well
+
+        :return: True if the table had a former layout"""
+        columns = sink.get_columns(self.__salary_table__)
+        if columns is None:
+            return False
+        conversions = {}
+        if LEGACY_COLUMN in columns:
+            conversions = {'valeur': (sqla.Float(precision=53), LEGACY_COLUMN), 'mois': (sqla.DateTime(), to_month)}
+        dropped = [c for c in [LEGACY_COLUMN, INDEX_COLUMN] if c in columns]
+        if len(dropped) == 0:
+            return False
+        rows = sink.migrate_columns(self.__salary_table__, conversions, dropped)
+        o.print_warning(f'the {self.__salary_table__} table had a former layout, {rows} rows migrated')
+        return True
+
+    def save_dataframe_to_sql(self, df: pd.DataFrame, delta: bool = False) -> int:
         """
         Save the data frame to the PostGres database
+        The table of the former layout, with the Valeur Numérique column, is migrated first
+        :param delta: False to replace the whole table,
+            True to insert the new months and update the changed values only, keyed by categorie, poste and mois
+        :return: the number of rows written
         """
-        rows = load_to_table('salaires', df)
-        rows = get_row_count('salaires')
-        return rows
\ No newline at end of file
+        sink = DatabaseSink()
+        self.migrate_legacy_table(sink)
+        if not delta:
+            return sink.replace_table(self.__salary_table__, df, index=False)
+        inserted, updated, unchanged = sink.upsert_table(self.__salary_table__, df, self.__salary_keys__)
+        o.print_event(f'salaries : {inserted} rows inserted, {updated} updated, {unchanged} unchanged')
+        return inserted + updated
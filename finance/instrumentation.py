@@ -0,0 +1,277 @@
+# module recording the duration, the rows and the peak memory of the steps of a run,
+# as nested spans summed up in a JSON summary
+import contextlib
+import cProfile
+import datetime as dt
+import json
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import finance.output as o
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the memory is then only known with tracemalloc
+    resource = None
+
+
+class Span:
+    """ A timed step of a run.
+    A span entered several times under the same parent adds up its calls, e.g. the chunks of a file"""
+    __span_name__: str
+    __calls__: int
+    __seconds__: float
+    __rows__: int
+    __peak_memory__: int
+    __children__: dict
+
+    def __init__(self, name: str):
+        self.__span_name__ = name
+        self.__calls__ = 0
+        self.__seconds__ = 0.0
+        self.__rows__ = 0
+        self.__peak_memory__ = 0
+        self.__children__ = {}
+
+    @property
+    def name(self) -> str:
+        return self.__span_name__
+
+    @property
+    def seconds(self) -> float:
+        return self.__seconds__
+
+    @property
+    def rows(self) -> int:
+        return self.__rows__
+
+    def add_rows(self, rows: int):
+        self.__rows__ += rows
+
+    def add_call(self, seconds: float, peak_memory: int):
+        self.__calls__ += 1
+        self.__seconds__ += seconds
+        self.add_peak_memory(peak_memory)
+
+    def add_peak_memory(self, peak_memory: int):
+        self.__peak_memory__ = max(self.__peak_memory__, peak_memory)
+
+    def get_peak_memory(self) -> int:
+        return self.__peak_memory__
+
+    def get_child(self, name: str) -> 'Span':
+        if name not in self.__children__:
+            self.__children__[name] = Span(name)
+        return self.__children__[name]
+
+    def get_children(self) -> list:
+        return list(self.__children__.values())
+
+    def merge(self, summary: dict):
+        """ adds up a span summary, e.g. the span of a file converted in another process"""
+        self.__calls__ += summary['calls']
+        self.__seconds__ += summary['seconds']
+        self.__rows__ += summary['rows']
+        self.add_peak_memory(round(summary['peak_memory_mb'] * 2 ** 20))
+        for child in summary.get('children', []):
+            self.get_child(child['name']).merge(child)
+
+    def to_dict(self) -> dict:
+        result = {'name': self.__span_name__,
+                  'calls': self.__calls__,
+                  'seconds': round(self.__seconds__, 4),
+                  'rows': self.__rows__,
+                  'rows_per_second': round(self.__rows__ / self.__seconds__)
+                  if self.__rows__ > 0 and self.__seconds__ > 0 else None,
+                  'peak_memory_mb': round(self.__peak_memory__ / 2 ** 20, 2)}
+        if len(self.__children__) > 0:
+            result['children'] = [c.to_dict() for c in self.__children__.values()]
+        return result
+
+
+class Recorder:
+    """ This class keeps the spans of a run.
+    Only the spans of the thread that started the recorder are recorded"""
+    __root__: Span
+    __current__: Span
+    __trace_memory__: bool
+    __profiled_span__: str
+    __profile_file__: Path
+    __thread__: int
+    __started__: dt.datetime
+
+    def __init__(self, trace_memory: bool = False, profiled_span: str = None, profile_file: Path = None):
+        """
+        :param trace_memory: True to measure the peak memory of each span with tracemalloc, which slows the run down.
+            False to report the peak resident memory of the process instead
+        :param profiled_span: the name of a span to run under cProfile, e.g. load
+        :param profile_file: the file the profile is dumped to, by default <span>.prof in the current folder
+        """
+        self.__root__ = Span('run')
+        self.__current__ = self.__root__
+        self.__trace_memory__ = trace_memory
+        self.__profiled_span__ = profiled_span
+        self.__profile_file__ = profile_file if profile_file is not None else Path(f'{profiled_span}.prof')
+        self.__thread__ = threading.get_ident()
+        self.__started__ = dt.datetime.now()
+
+    def is_tracing_memory(self) -> bool:
+        return self.__trace_memory__
+
+    def get_profiled_span(self) -> str:
+        return self.__profiled_span__
+
+    def get_profile_file(self) -> Path:
+        return self.__profile_file__
+
+    def is_recording(self) -> bool:
+        return threading.get_ident() == self.__thread__
+
+    def get_root(self) -> Span:
+        return self.__root__
+
+    def get_current(self) -> Span:
+        return self.__current__
+
+    def get_memory(self) -> int:
+        if self.__trace_memory__:
+            return tracemalloc.get_traced_memory()[1]
+        elif resource is not None:
+            # kilobytes on linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return 0
+
+    def start(self):
+        if self.__trace_memory__ and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.__started__ = dt.datetime.now()
+
+    def stop(self):
+        self.__root__.add_call((dt.datetime.now() - self.__started__).total_seconds(), self.get_memory())
+        if self.__trace_memory__ and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def enter(self, name: str) -> Iterator[Span]:
+        parent = self.__current__
+        span = parent.get_child(name)
+        if self.__trace_memory__:
+            # the peak is reset for the child, the parent keeps the peak reached so far
+            parent.add_peak_memory(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        profiler = None
+        if name == self.__profiled_span__:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self.__current__ = span
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.__profile_file__)
+            self.__current__ = parent
+            span.add_call(seconds, self.get_memory())
+            parent.add_peak_memory(span.get_peak_memory())
+
+    def get_summary(self) -> dict:
+        return {'started': self.__started__.isoformat(timespec='seconds'),
+                'memory': 'tracemalloc' if self.__trace_memory__ else 'max_rss',
+                'profile': str(self.__profile_file__) if self.__profiled_span__ is not None else None,
+                'spans': self.__root__.to_dict()}
+
+
+# the recorder of the current run, None when the run is not instrumented
+recorder: Recorder = None
+
+
+def start(trace_memory: bool = False, profiled_span: str = None, profile_file: Path = None) -> Recorder:
+    """ starts recording the spans of the run, see Recorder"""
+    global recorder
+    recorder = Recorder(trace_memory, profiled_span, profile_file)
+    recorder.start()
+    return recorder
+
+
+def stop() -> dict:
+    """ stops recording
+    :return: the summary of the run, None when nothing was recorded"""
+    global recorder
+    if recorder is None:
+        return None
+    recorder.stop()
+    summary = recorder.get_summary()
+    recorder = None
+    return summary
+
+
+@contextlib.contextmanager
+def span(name: str, rows: int = None) -> Iterator[Span]:
+    """ times the enclosed step under the current span.
+    The rows are given up front or added to the yielded span with add_rows.
+    Outside of a recorded run the span is measured nowhere, at no cost"""
+    if recorder is None or not recorder.is_recording():
+        yield Span(name)
+        return
+    with recorder.enter(name) as s:
+        if rows is not None:
+            s.add_rows(rows)
+        yield s
+
+
+def call_in_span(name: str, trace_memory: bool, function, *args, profiled_span: str = None,
+                 profile_file: Path = None) -> tuple:
+    """ runs the function in a span of its own, in a worker process for instance
+    :param profiled_span: the span to run under cProfile, see get_profile
+    :return: the result of the function and the summary of the span, to be given to attach"""
+    global recorder
+    saved = recorder
+    recorder = Recorder(trace_memory, profiled_span, profile_file)
+    recorder.start()
+    try:
+        with recorder.enter(name):
+            result = function(*args)
+        return result, recorder.get_root().get_child(name).to_dict()
+    finally:
+        recorder.stop()
+        recorder = saved
+
+
+def attach(summary: dict, rows: int = None):
+    """ adds up a span summary returned by call_in_span under the current span"""
+    if recorder is None or not recorder.is_recording():
+        return
+    span = recorder.get_current().get_child(summary['name'])
+    span.merge(summary)
+    if rows is not None:
+        span.add_rows(rows)
+    recorder.get_current().add_peak_memory(span.get_peak_memory())
+
+
+def is_tracing_memory() -> bool:
+    return recorder is not None and recorder.is_tracing_memory()
+
+
+def get_profile() -> dict:
+    """ the profiled span and the profile file of the run, to be given to call_in_span"""
+    if recorder is None:
+        return {'profiled_span': None, 'profile_file': None}
+    return {'profiled_span': recorder.get_profiled_span(), 'profile_file': recorder.get_profile_file()}
+
+
+def save_summary(summary: dict, p: Path = None):
+    """ writes the summary as JSON to the file, or to the console"""
+    text = json.dumps(summary, indent=2, ensure_ascii=False)
+    if p is None:
+        # written after the pending messages
+        o.flush()
+        print(text)
+    else:
+        with open(p, 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -0,0 +1,63 @@
+# module gathering the shortcuts taken through the odfpy internals to build large sheets quickly:
+# detached elements are cloned from prototypes and attached without the checks of the DOM methods.
+# They rely on the element layout of the odfpy versions listed below. With any other version
+# the public DOM methods are used instead, slower but safe
+import odf.element
+from odf.element import Element
+from odf.namespaces import __version__ as ODFPY_VERSION
+
+# the odfpy versions the shortcuts were checked against, see tests/test_odf_fastpath.py
+SUPPORTED_VERSIONS = ('1.4.1',)
+enabled = ODFPY_VERSION in SUPPORTED_VERSIONS
+
+
+def clone_element(prototype: Element) -> Element:
+    """ copies a detached element with its attributes but without its children.
+    This skips the grammar checks of the odf constructors, the prototype is assumed valid"""
+    if not enabled:
+        return Element(qname=prototype.qname, qattributes=prototype.attributes, check_grammar=False)
+    result = object.__new__(type(prototype))
+    result.__dict__.update(prototype.__dict__)
+    result.attributes = dict(prototype.attributes)
+    result.childNodes = []
+    return result
+
+
+def append_child(parent: Element, child: Element):
+    """ appends a detached element, built by this module, to the children of the parent"""
+    if not enabled:
+        parent.appendChild(child)
+        return
+    odf.element._append_child(parent, child)
+
+
+def insert_rows(table: Element, rows: list, ref: Element = None):
+    """ attaches a batch of detached rows before the ref row, or at the end of the table if ref is None.
+    The rows are spliced into the children list in one operation instead of one insertBefore per row"""
+    if len(rows) == 0:
+        return
+    if not enabled:
+        for row in rows:
+            table.insertBefore(row, ref)
+        return
+
+    children = table.childNodes
+    index = len(children) if ref is None else children.index(ref)
+    previous = children[index - 1] if index > 0 else None
+    for row in rows:
+        row.parentNode = table
+        row.previousSibling = previous
+        if previous is not None:
+            previous.nextSibling = row
+        previous = row
+    previous.nextSibling = ref
+    if ref is not None:
+        ref.previousSibling = previous
+    children[index:index] = rows
+
+    # register the rows in the document, as addElement does
+    document = table.ownerDocument
+    for row in rows:
+        table._setOwnerDoc(row)
+        if document is not None:
+            document.rebuild_caches(row)
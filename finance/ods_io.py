@@ -1,13 +1,22 @@
 from odf.opendocument import OpenDocumentSpreadsheet
 from odf.opendocument import load
 from odf.element import Element
+from odf.element import Text
+from odf.namespaces import OFFICENS
+from odf.namespaces import TABLENS
 from odf.table import Table
 from odf.table import TableRow
 from odf.table import TableCell
 from odf.text import P
 from pathlib import Path
+from bisect import bisect_right
+from typing import Iterator
 import datetime as dt
 import pandas as pd
+from finance.ods_reader import filter_sheets
+from finance.odf_fastpath import append_child
+from finance.odf_fastpath import clone_element
+import finance.odf_fastpath as odf_fastpath
 
 def generate_cell_empty(stylename: str = '', rule: str = '') -> Element:
     result = TableCell()
@@ -48,6 +57,75 @@ def generate_table_cell_datetime(content: dt.datetime, stylename: str = '', rule
         result.addElement(P(text=content.strftime('%d/%m/%Y %H:%M')))
     return result
 
+# the attribute holding the typed value of a cell, per value type
+VALUE_ATTRIBUTES = {'float': (OFFICENS, 'value'), 'date': (OFFICENS, 'date-value')}
+
+
+def format_column(col: pd.Series) -> tuple:
+    """ formats a dataframe column as ODS cells, column-wise.
+
+    :return: the value type, the office value of each cell (None for strings),
+        the display text of each cell and the missing value flags"""
+    missing = col.isna().tolist()
+    if pd.api.types.is_float_dtype(col):
+        texts = col.astype(str).tolist()
+        return 'float', texts, texts, missing
+    elif pd.api.types.is_datetime64_any_dtype(col):
+        values = col.dt.strftime('%Y-%m-%dT%H:%M:%S').tolist()
+        midnight = (col.dt.hour + col.dt.minute + col.dt.second == 0).to_numpy()
+        texts = col.dt.strftime('%d/%m/%Y').where(midnight, col.dt.strftime('%d/%m/%Y %H:%M')).tolist()
+        return 'date', values, texts, missing
+    else:
+        return 'string', None, col.astype(str).tolist(), missing
+
+
+class ColumnFormat:
+    """ Formats a dataframe column once for the bulk insertion.
+    The cells are cloned from prototypes carrying the value type, style and validation of the column"""
+    __values__: list
+    __texts__: list
+    __missing__: list
+    __cell__: Element
+    __empty_cell__: Element
+    __paragraph__: Element
+    __value_attribute__: tuple
+
+    def __init__(self, col: pd.Series, stylename: str = '', rule: str = ''):
+        value_type, self.__values__, self.__texts__, self.__missing__ = format_column(col)
+        self.__cell__ = TableCell(valuetype=value_type)
+        self.__value_attribute__ = VALUE_ATTRIBUTES.get(value_type)
+        self.__empty_cell__ = generate_cell_empty(stylename, rule)
+        if stylename != '':
+            self.__cell__.setAttribute('stylename', stylename)
+        if rule != '':
+            self.__cell__.setAttribute('contentvalidationname', rule)
+        self.__paragraph__ = P()
+
+    def generate_cell(self, index: int) -> Element:
+        if self.__missing__[index]:
+            return clone_element(self.__empty_cell__)
+        result = clone_element(self.__cell__)
+        if self.__value_attribute__ is not None:
+            result.attributes[self.__value_attribute__] = self.__values__[index]
+        paragraph = clone_element(self.__paragraph__)
+        append_child(paragraph, Text(self.__texts__[index]))
+        append_child(result, paragraph)
+        return result
+
+
+def to_typed_series(values: list) -> pd.Series:
+    """ converts typed cell values to a series, with a native dtype when the values allow it"""
+    present = [v for v in values if v is not None]
+    if len(present) > 0 and all([isinstance(v, float) for v in present]):
+        return pd.Series(values, dtype='float64')
+    elif len(present) > 0 and all([isinstance(v, pd.Timestamp) for v in present]):
+        return pd.Series(pd.to_datetime(values))
+    elif len(present) > 0 and all([isinstance(v, bool) for v in present]):
+        return pd.Series(values, dtype='bool' if len(present) == len(values) else 'boolean')
+    else:
+        return pd.Series(values, dtype='object')
+
+
 class CellWrapper:
     __cell__: Element
 
@@ -60,7 +138,7 @@ class CellWrapper:
 
     def get_cell_column_span(self) -> int:
         try:
-            span = self.__cell__.getAttribute('numbercolumnsrepeated')
+            span = self.__cell__.getAttrNS(TABLENS, 'number-columns-repeated')
             return 1 if span is None else int(span)
         except ValueError:
             return 1
@@ -71,6 +149,22 @@ class CellWrapper:
         else:
             return ''
 
+    def get_typed_value(self) -> any:
+        """ reads the typed office value of the cell instead of its display text.
+        Numbers, currencies and percentages are floats, dates are timestamps and empty cells are None"""
+        # the namespaced lookups skip the attribute name checks of getAttribute
+        value_type = self.__cell__.getAttrNS(OFFICENS, 'value-type')
+        if value_type is None:
+            return None
+        elif value_type in ('float', 'currency', 'percentage'):
+            return float(self.__cell__.getAttrNS(OFFICENS, 'value'))
+        elif value_type == 'date':
+            return pd.Timestamp(self.__cell__.getAttrNS(OFFICENS, 'date-value'))
+        elif value_type == 'boolean':
+            return self.__cell__.getAttrNS(OFFICENS, 'boolean-value') == 'true'
+        else:
+            return self.get_cell_value()
+
     def get_element_style(self) -> str:
         style = self.__cell__.getAttribute('stylename')
         return '' if style is None else style
@@ -84,11 +178,15 @@ class CellWrapper:
 class RowWrapper:
     __element__: Element
     __stylename__: str
+    __cells__: list
+    __column_ends__: list
 
     def __init__(self, stylename: str = ''):
         self.__element__ = TableRow()
+        self.__stylename__ = stylename
+        self.__cells__ = None
+        self.__column_ends__ = None
         if stylename != '':
-            self.__stylename__ = stylename
             self.__element__.setAttribute('stylename', stylename)
 
     @property
@@ -98,25 +196,68 @@ class RowWrapper:
     @element.setter
     def element(self, elt: Element):
         self.__element__ = elt
+        # the cell index belongs to the previous element
+        self.__cells__ = None
+        self.__column_ends__ = None
+
+    def index_cells(self):
+        """ walks the cells once and stores the prefix sum of the column spans.
+        The index is rebuilt each time the element is replaced"""
+        if self.__cells__ is None:
+            cells = []
+            column_ends = []
+            max_index = 0
+            for e in self.__element__.getElementsByType(TableCell):
+                c = CellWrapper(e)
+                max_index += c.get_cell_column_span()
+                cells.append(c)
+                column_ends.append(max_index)
+            self.__cells__ = cells
+            self.__column_ends__ = column_ends
+
+    def get_cell(self, index: int) -> CellWrapper:
+        """ returns the cell covering the column index, None beyond the last cell"""
+        self.index_cells()
+        position = bisect_right(self.__column_ends__, index)
+        if position < len(self.__cells__):
+            return self.__cells__[position]
 
     def is_row_empty(self) -> bool:
         analysis = [c.hasChildNodes() for c in self.__element__.childNodes]
         return not any(analysis)
 
     def get_cell_count(self) -> int:
-        result = 0
+        self.index_cells()
+        return self.__column_ends__[-1] if len(self.__column_ends__) > 0 else 0
+
+    def get_row_span(self) -> int:
+        try:
+            span = self.__element__.getAttribute('numberrowsrepeated')
+            return 1 if span is None else int(span)
+        except ValueError:
+            return 1
+
+    def get_runs(self, typed: bool = False) -> list:
+        """ retrieves the run-length encoded values of the row, as (value, span) pairs.
+        The trailing empty cells, usually one cell repeated over the whole sheet width, are left out
+
+        :param typed: True to read the typed values, see CellWrapper.get_typed_value"""
+        result = []
+        pending = []
         for e in self.__element__.getElementsByType(TableCell):
             c = CellWrapper(e)
-            result += c.get_cell_column_span()
+            value = c.get_typed_value() if typed else c.get_cell_value()
+            pending.append((value, c.get_cell_column_span()))
+            if value is not None and value != '':
+                result += pending
+                pending = []
         return result
 
-    def get_values(self) -> list:
-        """ iterates over all the cells and retrieves the value array"""
+    def get_values(self, typed: bool = False) -> list:
+        """ iterates over all the cells and retrieves the value array, up to the last non-empty cell"""
         result = []
-        for e in self.__element__.getElementsByType(TableCell):
-            c = CellWrapper(e)
-            span = c.get_cell_column_span()
-            result += [c.get_cell_value()] * span
+        for value, span in self.get_runs(typed):
+            result += [value] * span
         return result
 
     def get_value(self, column: int) -> any:
@@ -124,41 +265,97 @@ class RowWrapper:
            return self.__values__[column]
 
     def get_cell_style(self, index: int) -> str:
-        max_index = 0
-        for e in self.__element__.getElementsByType(TableCell):
-            c = CellWrapper(e)
-            max_index += c.get_cell_column_span()
-            if index < max_index:
-                if c.get_element_style() == '':
-                    return self.__stylename__
-                else:
-                    return c.get_element_style()
+        c = self.get_cell(index)
+        if c is not None:
+            if c.get_element_style() == '':
+                return self.__stylename__
+            else:
+                return c.get_element_style()
 
     def get_cell_validation(self, index: int) -> str:
-        max_index = 0
-        for e in self.__element__.getElementsByType(TableCell):
-            c = CellWrapper(e)
-            max_index += c.get_cell_column_span()
-            if index < max_index:
-                return c.get_cell_validation()
+        c = self.get_cell(index)
+        if c is not None:
+            return c.get_cell_validation()
 
 
 class SheetWrapper:
     __sheet__: Table
+    __rows__: list
 
     def __init__(self, value: Table):
         self.__sheet__ = value
+        self.__rows__ = None
 
     @property
     def name(self) -> str:
         return self.__sheet__.getAttribute('name')
 
+    def index_rows(self):
+        """ walks the table once and keeps the list of its rows.
+        The index is reset each time rows are inserted or removed"""
+        if self.__rows__ is None:
+            self.__rows__ = self.__sheet__.getElementsByType(TableRow)
+
+    def reset_row_index(self):
+        self.__rows__ = None
+
+    def iter_rows(self) -> Iterator[Element]:
+        """ iterates over the rows of the sheet"""
+        self.index_rows()
+        return iter(self.__rows__)
+
     def get_row(self, index: int) -> Element:
-        return self.__sheet__.getElementsByType(TableRow)[index]
+        self.index_rows()
+        return self.__rows__[index]
 
     def get_row_count(self) -> int:
-        return len(self.__sheet__.getElementsByType(TableRow))
-
+        self.index_rows()
+        return len(self.__rows__)
+
+    def iter_values(self, typed: bool = False) -> Iterator[list]:
+        """ iterates over the values of the rows, see RowWrapper.get_values.
+        The repeated rows are expanded, except the trailing empty rows which are left out"""
+        rw = RowWrapper()
+        empty_rows = 0
+        for r in self.iter_rows():
+            rw.element = r
+            values = rw.get_values(typed)
+            if len(values) == 0:
+                empty_rows += rw.get_row_span()
+                continue
+            for i in range(empty_rows):
+                yield []
+            empty_rows = 0
+            for i in range(rw.get_row_span()):
+                yield list(values)
+
+    def to_dataframe(self, header_row: int = 0, region: tuple = None) -> pd.DataFrame:
+        """ reads the typed values of the sheet into a dataframe, without going through the display text.
+        Each column gets a float64, datetime64 or bool dtype when all its values share that type.
+
+        :param header_row: the index of the row holding the column names
+        :param region: the (first row, last row, first column, last column) bounds of the data,
+            the last bounds being excluded and None meaning open. By default, all the rows below the header
+        :return: the dataframe"""
+        row_start, row_stop, column_start, column_stop = (None, None, None, None) if region is None else region
+        if row_start is None:
+            row_start = header_row + 1
+
+        headers = []
+        data = []
+        for i, values in enumerate(self.iter_values(typed=True)):
+            if i == header_row:
+                headers = values[column_start:column_stop]
+            elif i >= row_start and (row_stop is None or i < row_stop):
+                data.append(values[column_start:column_stop])
+            elif row_stop is not None and i >= row_stop and i > header_row:
+                break
+
+        columns = [to_typed_series([row[j] if j < len(row) else None for row in data])
+                   for j in range(len(headers))]
+        df = pd.concat(columns, axis=1) if len(columns) > 0 else pd.DataFrame(index=range(len(data)))
+        df.columns = headers
+        return df
 
     def insert_from_array(self, table_of_values: list):
         for value_row in table_of_values:
@@ -170,71 +367,130 @@ class SheetWrapper:
                     row.addElement(generate_table_cell_text(str(value)))
             # add the row to the table
             self.__sheet__.addElement(row)
+        self.reset_row_index()
 
-    def insert_from_dataframe(self, df: pd.DataFrame, include_headers: bool = False, mode: str = 'overwrite'):
+    def insert_rows(self, rows: list, ref: Element = None):
+        """ attaches a batch of rows before the ref row, or at the end of the sheet if ref is None,
+        see odf_fastpath.insert_rows"""
+        odf_fastpath.insert_rows(self.__sheet__, rows, ref)
+        self.reset_row_index()
+
+    def insert_from_dataframe(self, df: pd.DataFrame, include_headers: bool = False, mode: str = 'overwrite',
+                              bulk: bool = False):
         """ inserts a pandas dataframe into the sheet.
 
         :param df: the dataframe to insert
         :param include_headers: True to include the dataframe headers in the import
         :param mode: the insertion mode.
             'overwrite' : erases all the rows and writes from scratch in the sheet.
-            'append' : finds the first empty row and then appends."""
+            'append' : finds the first empty row and then appends.
+        :param bulk: True to format the values column by column and build the cells from
+            per-column prototypes, see bulk_insert_rows. Missing values are written as empty cells."""
 
         empty_row = None
         if mode == 'overwrite':
             # delete all the rows
-            rows = self.__sheet__.getElementsByType(TableRow)
-            for r in rows:
+            for r in self.iter_rows():
                 self.__sheet__.removeChild(r)
+            self.reset_row_index()
         elif mode == 'append':
             # find the first empty row
-            rows = self.__sheet__.getElementsByType(TableRow)
-            for r in rows:
+            for r in self.iter_rows():
                 rw = RowWrapper()
                 rw.element = r
                 if rw.is_row_empty():
                     empty_row = rw
                     break
 
+        # without an empty row, the rows are unstyled and go at the end of the sheet
+        template = RowWrapper() if empty_row is None else empty_row
+        ref = None if empty_row is None else empty_row.element
+
         # create the headers
         if include_headers:
             row = TableRow()
             for c in df.columns:
                 row.addElement(generate_table_cell_text(c))
-            self.__sheet__.insertBefore(row, empty_row)
+            self.__sheet__.insertBefore(row, ref)
+
+        if bulk:
+            self.bulk_insert_rows(df, template, ref)
+            return
 
         # import the values
+        cell_count = template.get_cell_count()
         for df_row in df.itertuples(index=False):
             row = TableRow()
             for i in range(len(df.columns)):
-                style = empty_row.get_cell_style(i)
-                rule = empty_row.get_cell_validation(i)
-                if df.dtypes[i] == 'float64':
+                style = template.get_cell_style(i)
+                rule = template.get_cell_validation(i)
+                if df.dtypes.iloc[i] == 'float64':
                     row.addElement(generate_table_cell_float(df_row[i], style, rule))
-                elif df.dtypes[i] == r'datetime64[ns]':
+                elif df.dtypes.iloc[i] == r'datetime64[ns]':
                     row.addElement(generate_table_cell_datetime(df_row[i], style, rule))
                 else:
                     row.addElement(generate_table_cell_text(df_row[i], style, rule))
 
             # if there are extra styles, create empty cells
-            if empty_row.get_cell_count() > len(df.columns):
-                for i in range(len(df.columns), empty_row.get_cell_count()):
-                    row.addElement(generate_cell_empty(empty_row.get_cell_style(i),
-                                                       empty_row.get_cell_validation(i)))
+            if cell_count > len(df.columns):
+                for i in range(len(df.columns), cell_count):
+                    row.addElement(generate_cell_empty(template.get_cell_style(i),
+                                                       template.get_cell_validation(i)))
 
             # add the row to the table
-            self.__sheet__.insertBefore(row, empty_row.element)
+            self.__sheet__.insertBefore(row, ref)
+        self.reset_row_index()
+
+    def bulk_insert_rows(self, df: pd.DataFrame, template: RowWrapper, ref: Element = None):
+        """ inserts the dataframe rows before ref.
+        Type, style and validation are resolved once per column, the values are formatted
+        column-wise and every cell is cloned from a per-column prototype"""
+        columns = [ColumnFormat(df.iloc[:, i], template.get_cell_style(i), template.get_cell_validation(i))
+                   for i in range(len(df.columns))]
+
+        # the extra styled cells of the template row, after the dataframe columns
+        extra_cells = [generate_cell_empty(template.get_cell_style(i), template.get_cell_validation(i))
+                       for i in range(len(df.columns), template.get_cell_count())]
+
+        row_prototype = TableRow()
+        rows = []
+        for i in range(len(df)):
+            row = clone_element(row_prototype)
+            for c in columns:
+                append_child(row, c.generate_cell(i))
+            for c in extra_cells:
+                append_child(row, clone_element(c))
+            rows.append(row)
+
+        self.insert_rows(rows, ref)
 
 
 class SpreadsheetWrapper:
     __workbook__: OpenDocumentSpreadsheet
-    __sheets__ = {}
+    __sheets__: dict
+    __partial__: bool
 
     def __init__(self):
         self.__workbook__ = OpenDocumentSpreadsheet()
+        self.__sheets__ = {}
+        self.__partial__ = False
+
+    @property
+    def element(self) -> OpenDocumentSpreadsheet:
+        return self.__workbook__
 
-    def load(self, filepath: Path):
-        self.__workbook__ = load(filepath)
+    def load(self, filepath: Path, sheet_names: list = None):
+        """ loads the workbook.
+
+        :param filepath: the ODS file
+        :param sheet_names: the sheets to load, None for all of them.
+            The other sheets are skipped before parsing, such a workbook cannot be saved"""
+        if sheet_names is None:
+            self.__workbook__ = load(filepath)
+        else:
+            self.__workbook__ = load(filter_sheets(filepath, sheet_names))
+        self.__partial__ = sheet_names is not None
+        self.__sheets__ = {}
         for t in self.__workbook__.getElementsByType(Table):
             sheet = SheetWrapper(t)
             self.__sheets__[sheet.name] = sheet
@@ -243,6 +499,8 @@ class SpreadsheetWrapper:
         self.__workbook__.toXml('odsxml.xml')
 
     def save(self, filepath: Path):
+        if self.__partial__:
+            raise ValueError('the workbook was loaded with a subset of its sheets and cannot be saved')
         self.__workbook__.write(filepath)
 
     def get_sheets(self) -> dict:
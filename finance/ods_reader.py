@@ -0,0 +1,237 @@
+# module dedicated to streaming a single sheet out of an ODS file
+# without building the whole workbook in memory
+import datetime as dt
+import io
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import xml.sax
+import xml.sax.handler
+from xml.sax.saxutils import XMLFilterBase
+from xml.sax.saxutils import XMLGenerator
+from pathlib import Path
+from typing import Iterator
+
+NS_TABLE = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+NS_OFFICE = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+NS_TEXT = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+
+TAG_TABLE = f'{{{NS_TABLE}}}table'
+TAG_ROW = f'{{{NS_TABLE}}}table-row'
+TAG_CELL = f'{{{NS_TABLE}}}table-cell'
+TAG_COVERED_CELL = f'{{{NS_TABLE}}}covered-table-cell'
+TAG_PARAGRAPH = f'{{{NS_TEXT}}}p'
+TAG_HEADING = f'{{{NS_TEXT}}}h'
+TAG_SPACES = f'{{{NS_TEXT}}}s'
+TAG_TAB = f'{{{NS_TEXT}}}tab'
+TAG_LINE_BREAK = f'{{{NS_TEXT}}}line-break'
+
+ATTR_NAME = f'{{{NS_TABLE}}}name'
+ATTR_COLUMNS_REPEATED = f'{{{NS_TABLE}}}number-columns-repeated'
+ATTR_ROWS_REPEATED = f'{{{NS_TABLE}}}number-rows-repeated'
+ATTR_VALUE_TYPE = f'{{{NS_OFFICE}}}value-type'
+ATTR_VALUE = f'{{{NS_OFFICE}}}value'
+ATTR_DATE_VALUE = f'{{{NS_OFFICE}}}date-value'
+ATTR_TIME_VALUE = f'{{{NS_OFFICE}}}time-value'
+ATTR_BOOLEAN_VALUE = f'{{{NS_OFFICE}}}boolean-value'
+ATTR_CURRENCY = f'{{{NS_OFFICE}}}currency'
+ATTR_SPACE_COUNT = f'{{{NS_TEXT}}}c'
+
+# empty rows repeated this many times or more are read only once, the same way pyexcel_ods3 handles
+# the "filler" rows written by the office suite. The rows holding values are always expanded in full
+MAX_REPEAT_EXPANSION = 32
+
+
+def get_repeat(element: ElementTree.Element, attribute: str) -> int:
+    try:
+        return max(int(element.get(attribute, 1)), 1)
+    except ValueError:
+        return 1
+
+
+def get_text(element: ElementTree.Element) -> str:
+    """ renders the plain text of a paragraph, including the whitespace elements"""
+    text = [element.text]
+    for child in element:
+        if child.tag == TAG_SPACES:
+            text.append(' ' * int(child.get(ATTR_SPACE_COUNT, 1)))
+        elif child.tag == TAG_TAB:
+            text.append('\t')
+        elif child.tag == TAG_LINE_BREAK:
+            text.append('\n')
+        else:
+            text.append(get_text(child))
+        text.append(child.tail)
+    return ''.join(filter(None, text))
+
+
+def get_number(value: str) -> any:
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def get_date(value: str) -> any:
+    if len(value) == 10:
+        return dt.datetime.strptime(value, '%Y-%m-%d').date()
+    elif len(value) == 19:
+        return dt.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    else:
+        return dt.datetime.strptime(value[0:26], '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def get_cell_value(cell: ElementTree.Element, keep_currency: bool = True) -> any:
+    """ converts a cell to a python value, the same way pyexcel_ods3.get_data does.
+    With keep_currency False, currencies are read as plain numbers instead of '<value> <currency>' texts"""
+    value_type = cell.get(ATTR_VALUE_TYPE)
+    if value_type is None:
+        return ''
+    elif value_type == 'float':
+        return get_number(cell.get(ATTR_VALUE))
+    elif value_type == 'percentage':
+        return float(cell.get(ATTR_VALUE))
+    elif value_type == 'currency' and not keep_currency:
+        return float(cell.get(ATTR_VALUE))
+    elif value_type == 'currency':
+        return f'{get_number(cell.get(ATTR_VALUE))} {cell.get(ATTR_CURRENCY)}'
+    elif value_type == 'date':
+        return get_date(cell.get(ATTR_DATE_VALUE))
+    elif value_type == 'boolean':
+        return cell.get(ATTR_BOOLEAN_VALUE) == 'true'
+    else:
+        return '\n'.join([get_text(p) for p in cell if p.tag in (TAG_PARAGRAPH, TAG_HEADING)])
+
+
+def get_row_values(row: ElementTree.Element, keep_currency: bool = True) -> list:
+    """ expands the cells of a row and trims the trailing empty cells.
+    The empty runs are kept as (value, count) until a value follows them,
+    so the trailing filler cells are never expanded"""
+    result = []
+    pending = []
+    for cell in row:
+        if cell.tag not in (TAG_CELL, TAG_COVERED_CELL):
+            continue
+        value = get_cell_value(cell, keep_currency) if cell.tag == TAG_CELL else ''
+        pending.append((value, get_repeat(cell, ATTR_COLUMNS_REPEATED)))
+        if value is not None and value != '':
+            for v, count in pending:
+                result += [v] * count
+            pending = []
+    return result
+
+
+class SheetReader:
+    """ This class streams the rows of one sheet of an ODS file.
+    Only content.xml is read, incrementally, and every other sheet is skipped"""
+    __filepath__: Path
+    __sheet_name__: str
+    __keep_currency__: bool
+
+    def __init__(self, filepath: Path, sheet_name: str, keep_currency: bool = True):
+        """
+        :param filepath: the ODS file
+        :param sheet_name: the sheet to read
+        :param keep_currency: False to read the currency cells as numbers, from their typed value
+        """
+        self.__filepath__ = filepath
+        self.__sheet_name__ = sheet_name
+        self.__keep_currency__ = keep_currency
+
+    @property
+    def sheet_name(self) -> str:
+        return self.__sheet_name__
+
+    def iter_rows(self) -> Iterator[list]:
+        """ yields the values of each row of the sheet"""
+        found = False
+        in_sheet = False
+        with zipfile.ZipFile(self.__filepath__) as archive:
+            with archive.open('content.xml') as content:
+                for event, element in ElementTree.iterparse(content, events=('start', 'end')):
+                    if element.tag == TAG_TABLE:
+                        if event == 'start':
+                            in_sheet = element.get(ATTR_NAME) == self.__sheet_name__
+                            found = found or in_sheet
+                        else:
+                            element.clear()
+                            if in_sheet:
+                                # the sheet is complete, no need to read the rest of the file
+                                return
+                    elif event == 'end' and element.tag == TAG_ROW:
+                        if in_sheet:
+                            values = get_row_values(element, self.__keep_currency__)
+                            repeat = get_repeat(element, ATTR_ROWS_REPEATED)
+                            if len(values) == 0 and repeat >= MAX_REPEAT_EXPANSION:
+                                repeat = 1
+                            for i in range(repeat):
+                                yield list(values)
+                        element.clear()
+        if not found:
+            raise KeyError(self.__sheet_name__)
+
+    def read_table(self, first_header: str = 'Date') -> tuple:
+        """ finds the header row, i.e. the first row starting with first_header
+
+        :param first_header: the value of the first cell of the header row
+        :return: the header values and an iterator over the data rows below it"""
+        rows = self.iter_rows()
+        for row in rows:
+            if len(row) > 0 and row[0] == first_header:
+                return row, self.iter_data_rows(rows, len(row))
+        raise ValueError(f'no header row starting with {first_header} in sheet {self.__sheet_name__}')
+
+    def iter_data_rows(self, rows: Iterator[list], width: int) -> Iterator[list]:
+        for row in rows:
+            yield row[:width]
+
+
+class SheetFilter(XMLFilterBase):
+    """ SAX filter dropping the sheets that were not asked for, everything else is passed through"""
+    __sheet_names__: set
+    __depth__: int
+
+    def __init__(self, parent, sheet_names: set):
+        super().__init__(parent)
+        self.__sheet_names__ = sheet_names
+        self.__depth__ = 0
+
+    def startElementNS(self, name, qname, attrs):
+        if self.__depth__ > 0:
+            self.__depth__ += 1
+        elif name == (NS_TABLE, 'table') and attrs.get((NS_TABLE, 'name')) not in self.__sheet_names__:
+            self.__depth__ = 1
+        else:
+            super().startElementNS(name, qname, attrs)
+
+    def endElementNS(self, name, qname):
+        if self.__depth__ > 0:
+            self.__depth__ -= 1
+        else:
+            super().endElementNS(name, qname)
+
+    def characters(self, content):
+        if self.__depth__ == 0:
+            super().characters(content)
+
+    def ignorableWhitespace(self, whitespace):
+        if self.__depth__ == 0:
+            super().ignorableWhitespace(whitespace)
+
+
+def filter_sheets(filepath: Path, sheet_names: list) -> io.BytesIO:
+    """ copies the ODS file in memory, keeping only the given sheets in content.xml.
+    The copy can be loaded with odfpy at the cost of the kept sheets only"""
+    result = io.BytesIO()
+    with zipfile.ZipFile(filepath) as source, zipfile.ZipFile(result, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            if item.filename != 'content.xml':
+                target.writestr(item, source.read(item.filename))
+        content = io.BytesIO()
+        parser = xml.sax.make_parser()
+        parser.setFeature(xml.sax.handler.feature_namespaces, True)
+        parser.setFeature(xml.sax.handler.feature_external_ges, False)
+        sheet_filter = SheetFilter(parser, set(sheet_names))
+        sheet_filter.setContentHandler(XMLGenerator(content, 'utf-8', short_empty_elements=True))
+        with source.open('content.xml') as xml_file:
+            sheet_filter.parse(xml_file)
+        target.writestr('content.xml', content.getvalue())
+    result.seek(0)
+    return result
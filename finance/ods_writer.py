@@ -0,0 +1,197 @@
+# module dedicated to streaming large exports into an ODS file
+# the data rows are written as XML text straight into the zip, no DOM is built for them
+import datetime as dt
+import io
+import zipfile
+from pathlib import Path
+from typing import Iterable
+from typing import Iterator
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+import pandas as pd
+from odf.table import TableRow
+
+import finance.ods_io as ods_io
+
+MIMETYPE = 'application/vnd.oasis.opendocument.spreadsheet'
+# marker written in place of the data rows when the template is serialized
+STREAM_MARKER = 'finance.ods_writer.rows'
+
+
+def generate_cell_xml(value_type: str, stylename: str = '', rule: str = '') -> tuple:
+    """ generates the opening and closing xml of a cell, the value and the text go in between
+
+    :return: the cell start (without the value attribute), the empty cell and the end of the cell"""
+    attributes = ''
+    if stylename != '':
+        attributes += f' table:style-name={quoteattr(stylename)}'
+    if rule != '':
+        attributes += f' table:content-validation-name={quoteattr(rule)}'
+    start = f'<table:table-cell office:value-type="{value_type}"{attributes}'
+    empty = f'<table:table-cell{attributes}/>'
+    return start, empty, '</text:p></table:table-cell>'
+
+
+class ColumnXml:
+    """ The xml fragments of a column, resolved once for the whole export"""
+    __stylename__: str
+    __rule__: str
+    __fragments__: dict
+
+    def __init__(self, stylename: str = '', rule: str = ''):
+        self.__stylename__ = stylename
+        self.__rule__ = rule
+        self.__fragments__ = {}
+
+    def get_fragments(self, value_type: str) -> tuple:
+        if value_type not in self.__fragments__:
+            self.__fragments__[value_type] = generate_cell_xml(value_type, self.__stylename__, self.__rule__)
+        return self.__fragments__[value_type]
+
+    def get_empty_cell(self) -> str:
+        return self.get_fragments('string')[1]
+
+    def format_column(self, col: pd.Series) -> list:
+        """ formats a whole column into cell xml, column-wise"""
+        value_type, values, texts, missing = ods_io.format_column(col)
+        start, empty, end = self.get_fragments(value_type)
+        if values is None:
+            return [empty if m else f'{start}><text:p>{escape(t)}{end}' for t, m in zip(texts, missing)]
+        attribute = 'office:value' if value_type == 'float' else 'office:date-value'
+        return [empty if m else f'{start} {attribute}="{v}"><text:p>{escape(t)}{end}'
+                for v, t, m in zip(values, texts, missing)]
+
+    def format_value(self, value: any) -> str:
+        """ formats a single value, following the same rules as SheetWrapper.insert_from_array"""
+        if value is None:
+            return self.get_empty_cell()
+        elif isinstance(value, float):
+            start, empty, end = self.get_fragments('float')
+            return f'{start} office:value="{value}"><text:p>{value}{end}'
+        elif isinstance(value, dt.datetime):
+            start, empty, end = self.get_fragments('date')
+            text = value.strftime('%d/%m/%Y') if value.hour + value.minute + value.second == 0 \
+                else value.strftime('%d/%m/%Y %H:%M')
+            return f'{start} office:date-value="{value.strftime("%Y-%m-%dT%H:%M:%S")}"><text:p>{text}{end}'
+        else:
+            start, empty, end = self.get_fragments('string')
+            return f'{start}><text:p>{escape(str(value))}{end}'
+
+
+class SpreadsheetStreamWriter:
+    """ This class exports rows into a copy of a template workbook.
+    The styles, validations and other sheets of the template are kept, the rows of the target
+    sheet are streamed into content.xml as they are produced"""
+    __template__: Path
+    __sheet_name__: str
+    __mode__: str
+
+    def __init__(self, template: Path, sheet_name: str, mode: str = 'append'):
+        """
+        :param template: the workbook providing the styles and validations
+        :param sheet_name: the sheet receiving the rows
+        :param mode: the insertion mode, as in SheetWrapper.insert_from_dataframe.
+            'overwrite' : the rows of the template sheet are dropped.
+            'append' : the rows are written before the first empty row, whose cell styles are used.
+        """
+        self.__template__ = template
+        self.__sheet_name__ = sheet_name
+        self.__mode__ = mode
+
+    def prepare_template(self) -> tuple:
+        """ loads the template, replaces the data rows with a marker and finds the column styles
+
+        :return: the content.xml before and after the data rows and the xml fragments of each column"""
+        wkb = ods_io.SpreadsheetWrapper()
+        wkb.load(self.__template__)
+        sheet = wkb.get_sheets()[self.__sheet_name__]
+
+        empty_row = None
+        if self.__mode__ == 'overwrite':
+            for r in sheet.iter_rows():
+                r.parentNode.removeChild(r)
+            sheet.reset_row_index()
+        elif self.__mode__ == 'append':
+            for r in sheet.iter_rows():
+                rw = ods_io.RowWrapper()
+                rw.element = r
+                if rw.is_row_empty():
+                    empty_row = rw
+                    break
+        template = ods_io.RowWrapper() if empty_row is None else empty_row
+
+        marker = TableRow()
+        marker.addElement(ods_io.generate_table_cell_text(STREAM_MARKER))
+        sheet.insert_rows([marker], None if empty_row is None else empty_row.element)
+        marker_xml = io.StringIO()
+        marker.toXml(1, marker_xml)
+        head, tail = wkb.element.contentxml().decode('utf-8').split(marker_xml.getvalue())
+
+        columns = [ColumnXml(template.get_cell_style(i) or '', template.get_cell_validation(i) or '')
+                   for i in range(template.get_cell_count())]
+        return head, tail, columns
+
+    def get_column(self, columns: list, index: int) -> ColumnXml:
+        if index >= len(columns):
+            columns.append(ColumnXml())
+        return columns[index]
+
+    def write(self, filepath: Path, chunks: Iterator[str], head: str, tail: str):
+        """ writes the template parts and streams the content.xml"""
+        with zipfile.ZipFile(self.__template__) as source, zipfile.ZipFile(filepath, 'w') as target:
+            # the mimetype must come first and stay uncompressed
+            target.writestr('mimetype', MIMETYPE, compress_type=zipfile.ZIP_STORED)
+            for item in source.infolist():
+                if item.filename not in ('mimetype', 'content.xml'):
+                    target.writestr(item, source.read(item.filename), compress_type=zipfile.ZIP_DEFLATED)
+
+            info = zipfile.ZipInfo('content.xml', dt.datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with target.open(info, 'w', force_zip64=True) as content:
+                content.write(head.encode('utf-8'))
+                for chunk in chunks:
+                    content.write(chunk.encode('utf-8'))
+                content.write(tail.encode('utf-8'))
+
+    def write_dataframe(self, filepath: Path, df: pd.DataFrame, include_headers: bool = False,
+                        chunksize: int = 10000) -> int:
+        """ exports the dataframe into the target sheet, chunksize rows at a time.
+        The values are formatted column-wise, as in the bulk mode of insert_from_dataframe
+
+        :return: the number of rows written"""
+        head, tail, columns = self.prepare_template()
+        for i in range(len(df.columns)):
+            self.get_column(columns, i)
+        extra_cells = ''.join([c.get_empty_cell() for c in columns[len(df.columns):]])
+
+        def generate_chunks() -> Iterator[str]:
+            if include_headers:
+                yield '<table:table-row>' + ''.join([ColumnXml().format_value(str(c)) for c in df.columns]) \
+                      + '</table:table-row>'
+            for start in range(0, len(df), chunksize):
+                chunk = df.iloc[start:start + chunksize]
+                cells = [columns[i].format_column(chunk.iloc[:, i]) for i in range(len(df.columns))]
+                yield ''.join(['<table:table-row>' + ''.join(row) + extra_cells + '</table:table-row>'
+                               for row in zip(*cells)])
+
+        self.write(filepath, generate_chunks(), head, tail)
+        return len(df)
+
+    def write_rows(self, filepath: Path, rows: Iterable[list]) -> int:
+        """ exports rows coming from any iterable, e.g. a generator, one row at a time
+
+        :return: the number of rows written"""
+        head, tail, columns = self.prepare_template()
+        count = 0
+
+        def generate_rows() -> Iterator[str]:
+            nonlocal count
+            for row in rows:
+                cells = [self.get_column(columns, i).format_value(v) for i, v in enumerate(row)]
+                cells += [c.get_empty_cell() for c in columns[len(row):]]
+                count += 1
+                yield '<table:table-row>' + ''.join(cells) + '</table:table-row>'
+
+        self.write(filepath, generate_rows(), head, tail)
+        return count
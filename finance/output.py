@@ -1,8 +1,129 @@
 # module to display and render to the console
-import datetime as dt
-def print_title(title_text:str):
-    print(' '.join(['***', title_text, '***']))
+# the messages go through a levelled logger : quiet shows only the warnings, info the events
+# and debug the diagnostics as well. They are formatted once their level is known to be enabled,
+# and written by the thread of a queue listener so the callers never wait on the console
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from pathlib import Path
 
+LEVELS = {'quiet': logging.WARNING, 'info': logging.INFO, 'debug': logging.DEBUG}
 
-def print_event(event_text:str):
-    print(', '.join([str(dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')), str(event_text)]))
\ No newline at end of file
+
+class ConsoleFormatter(logging.Formatter):
+    """ Renders the titles between stars and the events after their timestamp"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s, %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, 'title', False):
+            return ' '.join(['***', record.getMessage(), '***'])
+        return super().format(record)
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """ Writes each record to the standard output current when it was logged,
+    even when it was redirected after the handler was created"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+        # no output is kept between the records, see emit
+        self.stream = None
+
+    def emit(self, record: logging.LogRecord):
+        self.stream = getattr(record, 'stream', sys.stdout)
+        try:
+            super().emit(record)
+        finally:
+            # the output may be closed after its redirect, it is not flushed again
+            self.stream = None
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """ This class hands the records over to the thread of a queue listener, writing them to its handlers.
+    The records of the other processes, e.g. the conversion workers, are written directly,
+    since the thread of the listener does not run in them"""
+    __listener__: logging.handlers.QueueListener
+    __pid__: int
+
+    def __init__(self, listener: logging.handlers.QueueListener):
+        super().__init__(listener.queue)
+        self.__listener__ = listener
+        self.__pid__ = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is rendered once, now: the args could change before the thread writes it
+        record.msg = record.getMessage()
+        record.args = None
+        record = super().prepare(record)
+        record.stream = sys.stdout
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if os.getpid() != self.__pid__:
+            self.__listener__.handle(record)
+        else:
+            super().enqueue(record)
+
+    def flush(self):
+        """ waits for the pending records to be written"""
+        if os.getpid() == self.__pid__:
+            self.__listener__.stop()
+            self.__listener__.start()
+        for target in self.__listener__.handlers:
+            target.flush()
+
+
+logger = logging.getLogger('finance')
+logger.propagate = False
+logger.setLevel(logging.INFO)
+console = ConsoleHandler()
+console.setFormatter(ConsoleFormatter())
+listener = logging.handlers.QueueListener(queue.SimpleQueue(), console, respect_handler_level=True)
+listener.start()
+handler = BackgroundHandler(listener)
+logger.addHandler(handler)
+atexit.register(handler.flush)
+
+
+def set_level(level: str):
+    """ :param level: quiet, info or debug"""
+    logger.setLevel(LEVELS[level])
+
+
+def is_debug() -> bool:
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def log_to_file(p: Path, max_bytes: int = 10 * 2 ** 20, backup_count: int = 5):
+    """ writes the messages to a file as well, rotated once it reaches max_bytes"""
+    file_handler = logging.handlers.RotatingFileHandler(p, maxBytes=max_bytes, backupCount=backup_count,
+                                                        encoding='utf-8')
+    file_handler.setFormatter(ConsoleFormatter())
+    listener.handlers += (file_handler,)
+
+
+def flush():
+    """ waits for the messages to be written, before writing to the console directly"""
+    handler.flush()
+
+
+def print_title(title_text: str, *args):
+    logger.info(title_text, *args, extra={'title': True})
+
+
+def print_event(event_text, *args):
+    """ the text is formatted with the args only when its level is enabled, e.g. print_event('%s rows', n)"""
+    logger.info(event_text, *args)
+
+
+def print_debug(event_text, *args):
+    logger.debug(event_text, *args)
+
+
+def print_warning(event_text, *args):
+    logger.warning(event_text, *args)
@@ -0,0 +1,79 @@
+# module describing the columns of the comptes extracts, shared by the readers and the loaders
+from typing import NamedTuple
+
+
+class Column(NamedTuple):
+    """ A column of the comptes extracts"""
+    name: str
+    """ the header of the column in the workbooks and the extracts"""
+    dtype: str
+    """ the type the column is read with. datetime64 columns are parsed while reading"""
+    parser: str = 'text'
+    """ the cleanup applied by the loader : text, number, amount, boolean, date or category"""
+    nullable: bool = True
+    loaded_name: str = None
+    """ the name of the column in the database, when it differs from the header"""
+
+    def get_loaded_name(self) -> str:
+        return self.name if self.loaded_name is None else self.loaded_name
+
+
+COMPTES_COLUMNS = (
+    # the Date column is read as text, the loader checks its format before parsing it
+    Column('Date', 'object', 'date', nullable=False),
+    Column('N°', 'float64', 'number', loaded_name='No'),
+    Column('Description', 'object'),
+    Column('Dépense', 'float64', 'amount'),
+    Column('N° de référence', 'object', loaded_name='no_de_reference'),
+    Column('Recette', 'float64', 'amount'),
+    Column('Taux de remboursement', 'float64', 'number', loaded_name='taux_remboursement'),
+    Column('Compte', 'object'),
+    Column('Catégorie', 'object', 'category'),
+    Column('Economie', 'object', 'boolean'),
+    Column('Réglé', 'object', 'boolean'),
+    Column('Mois', 'datetime64[ns]', 'date'),
+    Column("Date d'insertion", 'object'),
+    Column('Provision à payer', 'float64', 'amount'),
+    Column('Provision à récupérer', 'float64', 'amount'),
+    Column('Date remboursement', 'object'),
+    Column('Organisme', 'object'),
+    Column('Fait Marquant', 'object', loaded_name='fait_marquant'),
+    # not in the extracts, the loader adds it from the file name
+    Column('File Year', 'int64', 'number', nullable=False),
+)
+
+# the columns calculated by the loader
+COMPUTED_COLUMNS = ('Date Out of Bound',)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def get_column_names(columns: tuple = COMPTES_COLUMNS) -> tuple:
+    return tuple([c.name for c in columns])
+
+
+def get_loaded_column_names(columns: tuple = COMPTES_COLUMNS) -> tuple:
+    """ the names of the columns once loaded into the database"""
+    return tuple([c.get_loaded_name() for c in columns]) + COMPUTED_COLUMNS
+
+
+def get_renames(columns: tuple = COMPTES_COLUMNS) -> dict:
+    return {c.name: c.loaded_name for c in columns if c.loaded_name is not None}
+
+
+def get_columns(names, columns: tuple = COMPTES_COLUMNS) -> list:
+    """ the registered columns among the names, in the order of the names"""
+    registry = {c.name: c for c in columns}
+    return [registry[n] for n in names if n in registry]
+
+
+def get_read_dtypes(columns: list, text_numbers: bool = False) -> dict:
+    """ the dtypes given to the reader, the date columns being parsed apart
+    :param text_numbers: True to read the amounts and the numbers as texts, for the extracts holding
+        '<amount> EUR' values or a text in a number column"""
+    return {c.name: 'object' if text_numbers and c.parser in ('amount', 'number') else c.dtype
+            for c in columns if not c.dtype.startswith('datetime64')}
+
+
+def get_date_columns(columns: list) -> list:
+    return [c.name for c in columns if c.dtype.startswith('datetime64')]
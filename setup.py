@@ -5,7 +5,8 @@ setup(
     version='1.1.4',
     packages=['finance'],
     entry_points = {'console_scripts': ['pyfin_load=finance.__main__:main']},
-    install_requires=['pandas', 'SQLAlchemy', 'setuptools', 'pyexcel_ods3', 'psycopg2-binary', 'watchdog'],
+    install_requires=['pandas>=2.0', 'SQLAlchemy', 'setuptools', 'psycopg2-binary', 'watchdog', 'odfpy~=1.4.1'],
+    extras_require={'arrow': ['pyarrow']},
     url='www.pyfin.org',
     license='GNU',
     author='vincent scherrer',
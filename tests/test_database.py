@@ -0,0 +1,166 @@
+from unittest import TestCase
+from finance.database import DatabaseSink, bulk_insert, prefetch, write_copy_rows
+from pathlib import Path
+import pandas as pd
+import sqlalchemy as sqla
+from sqlalchemy.dialects import postgresql
+from types import SimpleNamespace
+import tempfile
+
+
+def generate_comptes(year: int, count: int) -> pd.DataFrame:
+    return pd.DataFrame({'Description': [f'Ligne {year} {i}' for i in range(count)],
+                         'Dépense': [float(i) for i in range(count)],
+                         'File Year': [year] * count})
+
+
+def generate_salaires(values: list) -> pd.DataFrame:
+    """ one salary item, valued month by month from January 2023"""
+    return pd.DataFrame({'categorie': ['Revenus'] * len(values), 'poste': ['Salaire de base'] * len(values),
+                         'mois': pd.date_range('2023-01-01', periods=len(values), freq='MS'), 'valeur': values})
+
+
+class TestDatabaseSink(TestCase):
+    """ runs against a SQLite database standing in for the Postgres one"""
+    def setUp(self):
+        self.__folder__ = tempfile.TemporaryDirectory()
+        self.__sink__ = DatabaseSink('sqlite+pysqlite:///' + Path(self.__folder__.name).joinpath(
+            'finance.sqlite').as_posix())
+
+    def tearDown(self):
+        self.__sink__.get_engine().dispose()
+        self.__folder__.cleanup()
+
+    def read_table(self) -> pd.DataFrame:
+        with self.__sink__.get_engine().connect() as conn:
+            return pd.read_sql_table('comptes', conn)
+
+    def get_tables(self) -> list:
+        return sqla.inspect(self.__sink__.get_engine()).get_table_names()
+
+    def test_shared_engine(self):
+        self.assertIs(self.__sink__.get_engine(), DatabaseSink(self.__sink__.get_engine().url.render_as_string())
+                      .get_engine(), 'The sinks of a process should share their engine')
+
+    def test_replace_table(self):
+        self.assertEqual(3, self.__sink__.replace_table('comptes', generate_comptes(2022, 3)))
+        self.assertEqual(2, self.__sink__.replace_table('comptes', generate_comptes(2023, 2)))
+        df = self.read_table()
+        self.assertEqual([2023, 2023], df['File Year'].tolist())
+        self.assertEqual([0, 1], df['index'].tolist(), 'The index was not loaded')
+        self.assertEqual(2, self.__sink__.get_row_count('comptes'))
+        self.assertEqual(['comptes'], self.get_tables(), 'The staging table was not dropped')
+
+    def test_replace_table_definition(self):
+        self.__sink__.replace_table('comptes', generate_comptes(2022, 3))
+        with self.__sink__.get_engine().begin() as conn:
+            conn.execute(sqla.text('CREATE INDEX comptes_year ON comptes ("File Year")'))
+        self.__sink__.replace_table('comptes', generate_comptes(2023, 2))
+        self.assertEqual(['comptes_year'], [i['name'] for i in sqla.inspect(self.__sink__.get_engine())
+                         .get_indexes('comptes')], 'The definition of the table was not kept')
+        self.assertEqual([2023, 2023], self.read_table()['File Year'].tolist())
+
+    def test_schema(self):
+        conn = SimpleNamespace(dialect=postgresql.dialect())
+        self.assertEqual('public."Comptes"', DatabaseSink('postgresql://user@localhost/finance')
+                         .get_target(conn, 'Comptes'), 'The Postgres tables should be in the public schema')
+        self.assertEqual('"Comptes"', self.__sink__.get_target(conn, 'Comptes'), 'No schema on SQLite')
+
+    def test_replace_partitions(self):
+        rows = self.__sink__.replace_partitions('comptes', pd.concat([generate_comptes(2022, 3),
+                                                                      generate_comptes(2023, 2)],
+                                                                     ignore_index=True), 'File Year')
+        self.assertEqual(5, rows, 'The table was not created')
+
+        rows = self.__sink__.replace_partitions('comptes', generate_comptes(2023, 4), 'File Year')
+        self.assertEqual(4, rows, 'Only the changed year should be inserted')
+        df = self.read_table()
+        self.assertEqual(7, len(df))
+        self.assertEqual([3, 4], df.groupby('File Year').size().tolist())
+        self.assertEqual(list(range(7)), sorted(df['index'].tolist()), 'The index should stay a unique row id')
+        self.assertEqual(['comptes'], self.get_tables(), 'The staging table was not dropped')
+
+    def test_bulk_insert(self):
+        rows = bulk_insert(self.__sink__.get_engine(), 'comptes', generate_comptes(2023, 25), chunksize=10)
+        self.assertEqual(25, rows)
+        df = self.read_table()
+        self.assertEqual(25, len(df), 'The last partial batch was not inserted')
+        self.assertEqual(24.0, df['Dépense'].max())
+
+    def test_empty_texts(self):
+        df = pd.DataFrame({'Description': ['Courses', '', None], 'Dépense': [12.5, None, 3.0]})
+        self.assertEqual('"Courses",12.5\n"",\\N\n\\N,3.0\n',
+                         write_copy_rows(df.astype(object).where(df.notna(), None).itertuples(index=False))
+                         .getvalue(), 'The empty texts should be quoted apart from the NULL marker of COPY')
+        bulk_insert(self.__sink__.get_engine(), 'comptes', df, index=False)
+        result = self.read_table()
+        self.assertEqual(['Courses', ''], result['Description'].tolist()[:2])
+        self.assertIsNone(result['Description'][2], 'The executemany batches should keep NULL apart from the empty text')
+
+    def test_append_to_table(self):
+        self.assertIsNone(self.__sink__.get_max_value('comptes', 'File Year'))
+        chunks = [generate_comptes(2022, 3), generate_comptes(2023, 2)]
+        self.assertEqual(5, self.__sink__.append_to_table('comptes', iter(chunks)))
+        self.assertEqual(5, self.__sink__.append_to_table('comptes', generate_comptes(2024, 5)))
+        self.assertEqual(10, self.__sink__.get_row_count('comptes'))
+        self.assertEqual(2024, self.__sink__.get_max_value('comptes', 'File Year'))
+
+    def test_upsert_table(self):
+        keys = ['categorie', 'poste', 'mois']
+        self.assertEqual((2, 0, 0), self.__sink__.upsert_table(
+            'salaires', generate_salaires([2500.0, 2500.0]), keys), 'The table was not created')
+        self.assertEqual((1, 1, 1), self.__sink__.upsert_table(
+            'salaires', generate_salaires([2500.0, 2600.0, 2700.0]), keys), 'Only the new and changed months')
+        self.assertEqual((0, 0, 3), self.__sink__.upsert_table(
+            'salaires', generate_salaires([2500.0, 2600.0, 2700.0]), keys))
+        with self.__sink__.get_engine().connect() as conn:
+            df = pd.read_sql_table('salaires', conn).sort_values('mois')
+        self.assertEqual([2500.0, 2600.0, 2700.0], df['valeur'].tolist())
+        self.assertEqual(['salaires'], self.get_tables(), 'The staging table was not dropped')
+        self.assertEqual([True], [i['unique'] for i in sqla.inspect(self.__sink__.get_engine())
+                         .get_indexes('salaires')], 'The keys should have a unique index')
+
+    def test_upsert_duplicate_keys(self):
+        keys = ['categorie', 'poste', 'mois']
+        df = generate_salaires([2500.0, 2600.0])
+        df.loc[1, 'mois'] = df.loc[0, 'mois']
+        with self.assertRaises(ValueError, msg='The rows sharing their key should be rejected'):
+            self.__sink__.upsert_table('salaires', df, keys)
+        self.assertEqual([], self.get_tables(), 'Nothing should be loaded')
+
+        # a table loaded in full has no index yet, it is created by the first merge
+        self.__sink__.replace_table('salaires', generate_salaires([2500.0]).set_index('categorie'))
+        self.assertEqual((1, 0, 0), self.__sink__.upsert_table('salaires', generate_salaires([2500.0, 2600.0])
+                                                               .iloc[1:], keys))
+        with self.assertRaises(sqla.exc.IntegrityError):
+            with self.__sink__.get_engine().begin() as conn:
+                conn.execute(sqla.text("INSERT INTO salaires (categorie, poste, mois, valeur) "
+                                       "SELECT categorie, poste, mois, valeur FROM salaires"))
+
+
+class TestPrefetch(TestCase):
+    def test_order(self):
+        self.assertEqual(list(range(10)), list(prefetch(iter(range(10)), maxsize=1)))
+
+    def test_reader_error(self):
+        def generate():
+            yield 1
+            raise ValueError('broken chunk')
+
+        chunks = prefetch(generate())
+        self.assertEqual(1, next(chunks))
+        with self.assertRaises(ValueError):
+            next(chunks)
+
+    def test_early_stop(self):
+        read = []
+
+        def generate():
+            for i in range(1000):
+                read.append(i)
+                yield i
+
+        chunks = prefetch(generate(), maxsize=2)
+        self.assertEqual(0, next(chunks))
+        chunks.close()
+        self.assertLess(len(read), 10, 'The reader should stop when the writer does')
@@ -1,8 +1,13 @@
 from unittest import TestCase
-from finance.finance_extractor import FileLoader, FileConverter, DatabaseConverter
+from finance.finance_extractor import FileLoader, FileConverter, DatabaseConverter, FileManifest, FileStager
+from finance.database import DatabaseSink
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import datetime as dt
+import os
+import sqlalchemy
+import tempfile
 
 
 def generate_dataframe_with_zeroes() -> pd.DataFrame:
@@ -41,6 +46,12 @@ class TestDatabaseLoad(TestCase):
         print(s)
         print(s.isna())
 
+    def test_clean_boolean_columns(self):
+        fl = FileLoader(['Economie'])
+        s = fl.clean_boolean_columns(pd.Series([True, 'False', 'true', None, 1.0, 0, float('nan')]))
+        self.assertEqual('bool', s.dtype)
+        self.assertEqual([True, False, True, False, True, False, False], s.tolist())
+
     def test_3_convert_dates(self):
         # Load the dataframe
         fl = FileLoader(['Date'])
@@ -77,3 +88,177 @@ class TestDatabaseExtract(TestCase):
         self.assertGreater(len(df), 0, 'No rows founds')
 
 
+class TestDatabaseStream(TestCase):
+    def test_iter_transactions(self):
+        df = pd.DataFrame({'Date': pd.to_datetime(['2023-01-05', '2024-02-01', '2023-03-01']),
+                           "Date d'insertion": pd.to_datetime(['2023-01-06', '2023-02-02', '2023-03-02']),
+                           'File Year': [2023, 2023, 2023]})
+        with tempfile.TemporaryDirectory() as folder:
+            dc = DatabaseConverter()
+            dc.__connection_string__ = 'sqlite+pysqlite:///' + Path(folder).joinpath('finance.sqlite').as_posix()
+            e = sqlalchemy.create_engine(dc.__connection_string__)
+            df.to_sql('comptes', e)
+            e.dispose()
+            chunks = list(dc.iter_transactions(2))
+            new_rows = pd.concat(dc.iter_transactions(2, "Date d'insertion", '2023-03-02 00:00:00'))
+            DatabaseSink(dc.__connection_string__).get_engine().dispose()
+
+        self.assertEqual([2, 1], [len(c) for c in chunks])
+        self.assertEqual([False, True], chunks[0]['Date Out of Bound'].tolist())
+        self.assertEqual('index', chunks[0].index.name)
+        self.assertEqual([2], new_rows.index.tolist(), 'Only the rows from the watermark on should be read')
+
+    def test_watermark_day(self):
+        # a row was inserted on the day of the last migration, after it
+        df = pd.DataFrame({'Date': pd.to_datetime(['2023-01-05', '2023-02-01', '2023-02-03']),
+                           "Date d'insertion": pd.to_datetime(['2023-01-06', '2023-02-02', '2023-02-02']),
+                           'File Year': [2023, 2023, 2023]})
+        with tempfile.TemporaryDirectory() as folder:
+            dc = DatabaseConverter()
+            dc.__connection_string__ = 'sqlite+pysqlite:///' + Path(folder).joinpath('finance.sqlite').as_posix()
+            sink = DatabaseSink('sqlite+pysqlite:///' + Path(folder).joinpath('target.sqlite').as_posix())
+            e = sqlalchemy.create_engine(dc.__connection_string__)
+            df.to_sql('comptes', e)
+            e.dispose()
+            sink.replace_table('comptes', df.iloc[:2].set_index(df.index[:2].rename('index')))
+
+            watermark = sink.get_max_value('comptes', "Date d'insertion")
+            new_rows = pd.concat(dc.iter_transactions(2, "Date d'insertion", watermark))
+            self.assertEqual([1, 2], new_rows.index.tolist(), 'The rows on the watermark should be read again')
+            self.assertEqual(2, sink.replace_from('comptes', new_rows.drop(columns='Date Out of Bound'),
+                                                  "Date d'insertion", watermark))
+            with sink.get_engine().connect() as conn:
+                result = pd.read_sql_table('comptes', conn)
+            sink.get_engine().dispose()
+            DatabaseSink(dc.__connection_string__).get_engine().dispose()
+
+        self.assertEqual([0, 1, 2], sorted(result['index'].tolist()),
+                         'The rows of the watermark day should be neither lost nor duplicated')
+
+
+class TestFileManifest(TestCase):
+    def test_is_changed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source = Path(folder).joinpath('Comptes 2023.ods')
+            output = Path(folder).joinpath('Comptes 2023.csv')
+            source.write_bytes(b'version 1')
+            output.write_text('extract')
+
+            manifest = FileManifest(Path(folder).joinpath('manifest.json'))
+            self.assertTrue(manifest.is_changed('convert', source, output), 'A new file should be processed')
+            manifest.record('convert', source, output)
+            manifest.save()
+
+            manifest = FileManifest(Path(folder).joinpath('manifest.json'))
+            self.assertFalse(manifest.is_changed('convert', source, output), 'The manifest was not saved')
+            self.assertTrue(manifest.is_changed('stage', source, output), 'The steps should be independent')
+            os.utime(source, (0, 0))
+            self.assertFalse(manifest.is_changed('convert', source, output), 'A touched file is unchanged')
+            source.write_bytes(b'version 2')
+            self.assertTrue(manifest.is_changed('convert', source, output), 'The new content was not detected')
+            source.write_bytes(b'version 1')
+            output.unlink()
+            self.assertTrue(manifest.is_changed('convert', source, output), 'The missing output was not detected')
+
+
+class TestFileStager(TestCase):
+    def test_sweep_and_push(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source = Path(folder).joinpath('Bureau')
+            target = Path(folder).joinpath('Comptes')
+            source.mkdir()
+            target.mkdir()
+            for name in ['Comptes 2023.ods', 'Comptes 2023.ods.bak', 'Budget.ods']:
+                source.joinpath(name).write_bytes(b'content')
+            manifest_file = FileManifest.__manifest_file__
+            FileManifest.__manifest_file__ = Path(folder).joinpath('manifest.json')
+            try:
+                copied = FileStager().sweep_and_push(source, '^Comptes.*ods$', target)
+            finally:
+                FileManifest.__manifest_file__ = manifest_file
+            staged = [p.name for p in target.iterdir()]
+        self.assertEqual(1, copied, 'The mask should be matched as a regular expression')
+        self.assertEqual(['Comptes 2023.ods'], staged)
+
+
+def generate_converted_dataframe() -> pd.DataFrame:
+    """ builds a dataframe the way convert_account_file does, from typed cell values"""
+    headers = ['Date', 'N°', 'Description', 'Dépense', 'N° de référence', 'Recette',
+               'Taux de remboursement', 'Compte', 'Catégorie', 'Economie', 'Réglé', 'Mois',
+               "Date d'insertion", 'Provision à payer', 'Provision à récupérer',
+               'Date remboursement', 'Organisme', 'Fait Marquant', '']
+    rows = [[dt.date(2023, 1, 2), 1, 'Courses', 12.5, 'A12', '', '', 'Courant', 'alimentation',
+             True, '', dt.date(2023, 1, 1), dt.date(2023, 1, 3), '', '', '', '', '', ''],
+            [dt.date(2023, 1, 5), 2, 'Pharmacie', 30, 45, '', 0.7, 'Courant', 'santé',
+             '', True, dt.date(2023, 1, 1), dt.date(2023, 1, 6), '', '', '', 'CPAM', '', 'note'],
+            [dt.date(9999, 12, 31), 3, 'Salaire', '', '', 2500.25, '', 'Courant', 'revenus',
+             False, False, dt.date(2023, 1, 1), dt.date(2023, 1, 6), '', '', '', '', 'x', '']]
+    return pd.DataFrame(rows, columns=[headers])
+
+
+class TestExtractFormats(TestCase):
+    def test_typed_extracts(self):
+        df = generate_converted_dataframe()
+        fl = FileLoader(('Date', 'N°', 'Description', 'Dépense', 'N° de référence', 'Recette',
+                         'Taux de remboursement', 'Compte', 'Catégorie', 'Economie', 'Réglé', 'Mois',
+                         "Date d'insertion", 'Provision à payer', 'Provision à récupérer',
+                         'Date remboursement', 'Organisme', 'Fait Marquant', 'File Year'))
+        with tempfile.TemporaryDirectory() as folder:
+            fc = FileConverter()
+            fc.__extract_folder__ = Path(folder)
+            results = {}
+            for extract_format in ['csv', 'feather', 'parquet']:
+                fc.save_dataframe(df, 'Comptes 2023', extract_format)
+                p = fc.get_extract_path('Comptes 2023', extract_format)
+                self.assertTrue(p.exists(), f'The {extract_format} extract was not saved')
+                results[extract_format] = fl.load_dataframe(p)
+
+        self.assertEqual('float64', results['feather']['Dépense'].dtype, 'The amounts lost their type')
+        self.assertEqual(2023, results['feather']['File Year'][0])
+        expected = fl.cleanup_dataframe(results['csv'])
+        for extract_format in ['feather', 'parquet']:
+            pd.testing.assert_frame_equal(expected, fl.cleanup_dataframe(results[extract_format]),
+                                          check_dtype=False)
+
+    def test_schema_read(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2019.csv')
+            pd.DataFrame({'Date': ['2019-01-02', '9999-12-31'], 'Dépense': ['12.5 EUR', None],
+                          'Mois': ['2019-01-01', '2019-02-01'], 'Colonne libre': ['a', 'b']}).to_csv(p)
+            df = FileLoader().load_dataframe(p)
+        self.assertEqual(['Date', 'Dépense', 'Mois', 'File Year'], list(df.columns),
+                         'The columns out of the schema should not be read')
+        self.assertEqual('object', df['Date'].dtype, 'The dates should be read as texts, to be checked')
+        self.assertEqual('datetime64[ns]', df['Mois'].dtype)
+        self.assertEqual('12.5 EUR', df['Dépense'][0], 'The old amounts should be read as texts')
+
+    def test_text_number(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2019.csv')
+            pd.DataFrame({'Date': ['2019-01-02', '2019-01-03'], 'N°': ['12', 'chèque'],
+                          'Dépense': [12.5, 3.0]}).to_csv(p)
+            df = FileLoader().load_dataframe(p)
+        self.assertEqual('chèque', df['N°'][1], 'A text number should fall back to the text read')
+        numbers = FileLoader().clean_numbers(df['N°'])
+        self.assertEqual('float64', numbers.dtype)
+        self.assertEqual(12.0, numbers[0])
+        self.assertTrue(pd.isna(numbers[1]), 'The text should be left empty')
+
+    def test_chunks(self):
+        df = pd.concat([generate_converted_dataframe()] * 4)
+        fl = FileLoader()
+        with tempfile.TemporaryDirectory() as folder:
+            fc = FileConverter()
+            fc.__extract_folder__ = Path(folder)
+            for extract_format in ['csv', 'feather']:
+                fc.save_dataframe(df, 'Comptes 2023', extract_format)
+                p = fc.get_extract_path('Comptes 2023', extract_format)
+                chunks = [fl.cleanup_dataframe(c) for c in fl.iter_dataframe_chunks(p, 5)]
+                self.assertEqual([4, 3, 1], [len(c) for c in chunks], 'The placeholder dates should be dropped')
+                self.assertEqual(0, len(fl.check_wrong_dates_in_data_frame(pd.concat(chunks))))
+                pd.testing.assert_frame_equal(fl.cleanup_dataframe(fl.load_dataframe(p)),
+                                              pd.concat(chunks, ignore_index=True), check_dtype=False)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            FileConverter().get_extract_path('Comptes 2023', 'xlsx')
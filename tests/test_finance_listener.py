@@ -0,0 +1,117 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from finance.finance_listener import ComptesModifiedHandler, ListenerRuntime
+from watchdog.events import FileModifiedEvent, FileCreatedEvent, FileMovedEvent
+from pathlib import Path
+import asyncio
+import tempfile
+import time
+
+
+class TestComptesModifiedHandler(TestCase):
+    def test_debounce(self):
+        updates = []
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            p.write_bytes(b'workbook')
+            handler = ComptesModifiedHandler(settle_delay=0.2, update=updates.append)
+            # the events of a single save
+            handler.dispatch(FileCreatedEvent(str(Path(folder).joinpath('.~lock.Comptes 2023.ods#'))))
+            handler.dispatch(FileCreatedEvent(str(Path(folder).joinpath('lu1234.tmp'))))
+            handler.dispatch(FileMovedEvent(str(Path(folder).joinpath('lu1234.tmp')), str(p)))
+            handler.dispatch(FileModifiedEvent(str(p)))
+            handler.dispatch(FileModifiedEvent(str(Path(folder).joinpath('Comptes 2023.ods~'))))
+            self.assertEqual([p], handler.get_pending())
+            time.sleep(0.1)
+            handler.dispatch(FileModifiedEvent(str(p)))
+            time.sleep(0.15)
+            self.assertEqual([], updates, 'The update should wait for the events to settle')
+            time.sleep(0.3)
+
+        self.assertEqual([p], updates, 'The events of a save should give a single update')
+        self.assertEqual([], handler.get_pending())
+
+    def test_cancel_pending(self):
+        updates = []
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            p.write_bytes(b'workbook')
+            handler = ComptesModifiedHandler(settle_delay=0.1, update=updates.append)
+            handler.dispatch(FileModifiedEvent(str(p)))
+            self.assertEqual([p], handler.cancel_pending())
+            time.sleep(0.2)
+
+        self.assertEqual([], updates, 'The cancelled update should not run')
+        self.assertEqual([], handler.get_pending())
+
+
+def convert_workbook(p: Path, extract_format: str) -> int:
+    time.sleep(0.1)
+    return 1
+
+
+class TestListenerRuntime(TestCase):
+    def test_run(self):
+        loads = []
+
+        class Runtime(ListenerRuntime):
+            needs_conversion = staticmethod(lambda p, extract_format: True)
+            convert_file = staticmethod(convert_workbook)
+
+            @staticmethod
+            def load_workbook(p: Path, extract_format: str) -> int:
+                loads.append(p.name)
+                return 10
+
+        async def run(folder: Path) -> dict:
+            stop = asyncio.Event()
+            runtime = Runtime(folder, workers=2, settle_delay=0.1, executor=ThreadPoolExecutor(2))
+            task = asyncio.create_task(runtime.run(stop))
+            await asyncio.sleep(0.3)
+            for name in ['Comptes 2022.ods', 'Comptes 2023.ods', 'Comptes 2022.ods']:
+                folder.joinpath(name).write_bytes(b'workbook')
+                await asyncio.sleep(0.02)
+            for i in range(50):
+                await asyncio.sleep(0.1)
+                if runtime.get_status()['processed'] == 2:
+                    break
+            stop.set()
+            await task
+            return runtime.get_status()
+
+        with tempfile.TemporaryDirectory() as folder:
+            status = asyncio.run(run(Path(folder)))
+
+        self.assertEqual(['Comptes 2022.ods', 'Comptes 2023.ods'], sorted(loads), 'One job per saved workbook')
+        self.assertEqual(2, status['processed'])
+        self.assertEqual(20, status['rows'])
+        self.assertEqual(0, status['failed'])
+        self.assertEqual([], status['running'])
+
+    def test_stop_with_full_queue(self):
+        class Runtime(ListenerRuntime):
+            needs_conversion = staticmethod(lambda p, extract_format: False)
+
+            @staticmethod
+            def load_workbook(p: Path, extract_format: str) -> int:
+                time.sleep(0.5)
+                return 1
+
+        async def run(folder: Path) -> dict:
+            stop = asyncio.Event()
+            runtime = Runtime(folder, workers=1, settle_delay=0.05, queue_size=1, executor=ThreadPoolExecutor(1))
+            task = asyncio.create_task(runtime.run(stop))
+            await asyncio.sleep(0.3)
+            # the first workbook is saved again during its job, the others fill the queue
+            for name in ['Comptes 2021.ods', 'Comptes 2021.ods', 'Comptes 2022.ods', 'Comptes 2023.ods']:
+                folder.joinpath(name).write_bytes(b'workbook')
+                await asyncio.sleep(0.1)
+            stop.set()
+            await asyncio.wait_for(task, 5)
+            return runtime.get_status()
+
+        with tempfile.TemporaryDirectory() as folder:
+            status = asyncio.run(run(Path(folder)))
+
+        self.assertEqual(1, status['processed'], 'The running job should be completed, the queued ones dropped')
+        self.assertEqual([], status['running'])
@@ -1,5 +1,13 @@
 from unittest import TestCase
 import finance.finance_salaries as fs
+import finance.ods_io as ods_io
+from odf.table import Table, TableCell
+from odf.text import P
+from finance import database
+from pathlib import Path
+import datetime as dt
+import pandas as pd
+import tempfile
 
 class TestSalaryExtract(TestCase):
     def test_comptes_file(self):
@@ -21,15 +29,123 @@ class TestSalaryExtract(TestCase):
         wkb = se.get_spreadsheet(se.get_source_file())
         salaries = se.get_salary_sheet(wkb)
         result = se.parse_salary_sheet(salaries)
-        for r in result:
-            print(r)
+        print(result)
         self.assertIsNotNone(result)
 
     def test_salary_dataframe(self):
         se = fs.SalaryExtractor()
         wkb = se.get_spreadsheet(se.get_source_file())
         salaries = se.get_salary_sheet(wkb)
-        data = se.parse_salary_sheet(salaries)
-        df = se.convert_salaries_to_dataframe(data)
+        df = se.parse_salary_sheet(salaries)
         print(df)
-        self.assertIsNotNone(df)
+        self.assertEqual('datetime64[ns]', str(df['mois'].dtype))
+        self.assertEqual('float64', str(df['valeur'].dtype))
+
+
+def generate_salary_sheet() -> ods_io.SheetWrapper:
+    """ creates a salary sheet : a title, the month headers on the third row, one item per row"""
+    sheet = ods_io.SheetWrapper(Table(name='Salaires'))
+    sheet.insert_from_array([['Salaires'],
+                             [],
+                             ['Catégorie', 'Item', 'Commentaire', '01/01/23', '01/02/23'],
+                             ['Revenus', 'Salaire de base', '', '2.500,00 €', '2.550,00 €'],
+                             ['Retenues', 'CSG', '', '-200,50 €', '-204,00 €']])
+    sheet.get_row(4).addElement(TableCell(numbercolumnsrepeated='1000'))
+    return sheet
+
+
+class TestSalaryParser(TestCase):
+    def test_parse_generated_sheet(self):
+        se = fs.SalaryExtractor()
+        result = se.parse_salary_sheet(generate_salary_sheet())
+        rows = result.values.tolist()
+        self.assertIn(['Revenus', 'Salaire de base', pd.Timestamp(2023, 2, 1), 2550.0], rows)
+        self.assertIn(['Retenues', 'CSG', pd.Timestamp(2023, 1, 1), -200.5], rows)
+        self.assertEqual(4, len(result), 'The header row and the trailing empty cells should not produce values')
+
+    def test_salary_block(self):
+        sheet = generate_salary_sheet()
+        # a typed currency cell, an empty cell and a column past the last month
+        row = sheet.get_row(3)
+        # the display text of a currency cell is not parsed, its typed value is read
+        currency = TableCell(valuetype='currency', value='2600', currency='EUR')
+        currency.addElement(P(text='2 600,00 EUR'))
+        row.addElement(currency)
+        sheet.get_row(4).insertBefore(ods_io.generate_table_cell_text('-210,00 €'), sheet.get_row(4).lastChild)
+        sheet.get_row(2).addElement(ods_io.generate_table_cell_datetime(dt.datetime(2023, 3, 1)))
+        sheet.get_row(2).addElement(ods_io.generate_table_cell_text('Total'))
+        sheet.get_row(3).addElement(ods_io.generate_table_cell_text('7.650,00 €'))
+        block = fs.SalaryExtractor().get_salary_block(sheet)
+        self.assertEqual(['categorie', 'poste'] + list(pd.date_range('2023-01-01', periods=3, freq='MS')),
+                         list(block.columns))
+        self.assertEqual([2500.0, 2550.0, 2600.0], block.iloc[0, 2:].tolist())
+        self.assertEqual([-200.5, -204.0, -210.0], block.iloc[1, 2:].tolist())
+        self.assertEqual(6, len(fs.SalaryExtractor().parse_salary_sheet(sheet)))
+
+
+class TestSalaryLoad(TestCase):
+    def test_legacy_table(self):
+        with tempfile.TemporaryDirectory() as folder:
+            saved = database.CONNECTION_STRING
+            database.CONNECTION_STRING = 'sqlite+pysqlite:///' + Path(folder).joinpath('finance.sqlite').as_posix()
+            try:
+                sink = database.DatabaseSink()
+                # the former layout : texts and their numbers
+                pd.DataFrame({'categorie': ['Revenus'], 'poste': ['Salaire de base'], 'mois': ['01/01/23'],
+                              'valeur': ['2.500,00 €'], 'Valeur Numérique': [2500.0]}) \
+                    .to_sql('salaires', sink.get_engine())
+                se = fs.SalaryExtractor()
+                df = se.parse_salary_sheet(generate_salary_sheet())
+                # the delta load migrates the table in place, the former row matching its new value
+                self.assertEqual(3, se.save_dataframe_to_sql(df, delta=True))
+                self.assertNotIn('Valeur Numérique', sink.get_columns('salaires'), 'The table was not migrated')
+                self.assertEqual((0, 0, 4), sink.upsert_table('salaires', df, se.__salary_keys__))
+                self.assertEqual(4, se.save_dataframe_to_sql(df))
+            finally:
+                database.DatabaseSink().get_engine().dispose()
+                database.CONNECTION_STRING = saved
+
+    def test_delta_then_full(self):
+        with tempfile.TemporaryDirectory() as folder:
+            saved = database.CONNECTION_STRING
+            database.CONNECTION_STRING = 'sqlite+pysqlite:///' + Path(folder).joinpath('finance.sqlite').as_posix()
+            try:
+                sink = database.DatabaseSink()
+                se = fs.SalaryExtractor()
+                df = se.parse_salary_sheet(generate_salary_sheet())
+                # both loads write the same columns, whichever comes first
+                self.assertEqual(2, se.save_dataframe_to_sql(df.iloc[:2], delta=True))
+                self.assertEqual(4, se.save_dataframe_to_sql(df))
+                self.assertEqual(2, se.save_dataframe_to_sql(df.iloc[:2]))
+                self.assertEqual(2, se.save_dataframe_to_sql(df, delta=True))
+                self.assertEqual(['categorie', 'poste', 'mois', 'valeur'], sink.get_columns('salaires'))
+                self.assertEqual(4, sink.get_row_count('salaires'))
+            finally:
+                database.DatabaseSink().get_engine().dispose()
+                database.CONNECTION_STRING = saved
+
+    def test_former_index(self):
+        with tempfile.TemporaryDirectory() as folder:
+            saved = database.CONNECTION_STRING
+            database.CONNECTION_STRING = 'sqlite+pysqlite:///' + Path(folder).joinpath('finance.sqlite').as_posix()
+            try:
+                sink = database.DatabaseSink()
+                se = fs.SalaryExtractor()
+                df = se.parse_salary_sheet(generate_salary_sheet())
+                # a table of the former full loads, with the index of the data frame
+                sink.replace_table('salaires', df.iloc[:2])
+                self.assertEqual(2, se.save_dataframe_to_sql(df, delta=True))
+                self.assertNotIn('index', sink.get_columns('salaires'), 'The index column was not dropped')
+                self.assertEqual(4, sink.get_row_count('salaires'))
+            finally:
+                database.DatabaseSink().get_engine().dispose()
+                database.CONNECTION_STRING = saved
+
+    def test_convert_former_list(self):
+        se = fs.SalaryExtractor()
+        df = se.parse_salary_sheet(generate_salary_sheet())
+        self.assertIs(df, se.convert_salaries_to_dataframe(df))
+        result = se.convert_salaries_to_dataframe([['Revenus', 'Salaire de base', '01/01/23', '2.500,00'],
+                                                   ['Revenus', 'Salaire de base', '01/02/23', '']])
+        self.assertEqual([pd.Timestamp(2023, 1, 1)], result['mois'].tolist())
+        self.assertEqual([2500.0], result['valeur'].tolist())
@@ -0,0 +1,84 @@
+from unittest import TestCase
+from pathlib import Path
+import tempfile
+import threading
+
+import finance.instrumentation as instrumentation
+
+
+def count_rows(n: int) -> int:
+    with instrumentation.span('inner', n):
+        return n
+
+
+class TestInstrumentation(TestCase):
+    def tearDown(self):
+        instrumentation.stop()
+
+    def test_nested_spans(self):
+        instrumentation.start(trace_memory=True)
+        with instrumentation.span('load'):
+            for i in range(3):
+                with instrumentation.span('Comptes 2023.csv') as s:
+                    s.add_rows(10)
+                    data = [0] * 100000
+            with instrumentation.span('save', 30):
+                pass
+        summary = instrumentation.stop()
+        load = summary['spans']['children'][0]
+        self.assertEqual('load', load['name'])
+        self.assertEqual(['Comptes 2023.csv', 'save'], [c['name'] for c in load['children']])
+        self.assertEqual(3, load['children'][0]['calls'], 'The calls of a span should add up')
+        self.assertEqual(30, load['children'][0]['rows'])
+        self.assertEqual(30, load['children'][1]['rows'])
+        self.assertGreater(load['children'][0]['peak_memory_mb'], 0.5)
+        self.assertGreaterEqual(load['peak_memory_mb'], load['children'][0]['peak_memory_mb'])
+
+    def test_not_recording(self):
+        with instrumentation.span('load', 10) as s:
+            s.add_rows(5)
+        self.assertIsNone(instrumentation.stop(), 'Nothing should be recorded outside of a run')
+
+        instrumentation.start()
+        thread = threading.Thread(target=count_rows, args=(10,))
+        thread.start()
+        thread.join()
+        summary = instrumentation.stop()
+        self.assertNotIn('children', summary['spans'], 'The spans of other threads should be ignored')
+
+    def test_attach(self):
+        result, span_summary = instrumentation.call_in_span('Comptes 2023.ods', False, count_rows, 20)
+        self.assertEqual(20, result)
+        instrumentation.start()
+        with instrumentation.span('convert'):
+            instrumentation.attach(span_summary, result)
+            instrumentation.attach(span_summary, result)
+        summary = instrumentation.stop()
+        converted = summary['spans']['children'][0]['children'][0]
+        self.assertEqual('Comptes 2023.ods', converted['name'])
+        self.assertEqual(2, converted['calls'])
+        self.assertEqual(40, converted['rows'])
+        self.assertEqual(40, converted['children'][0]['rows'])
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('load.prof')
+            instrumentation.start(profiled_span='load', profile_file=p)
+            with instrumentation.span('load'):
+                count_rows(1)
+            summary = instrumentation.stop()
+            self.assertTrue(p.exists())
+        self.assertEqual(str(p), summary['profile'])
+
+    def test_profile_in_span(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods.prof')
+            instrumentation.start(profiled_span='Comptes 2023.ods', profile_file=p)
+            try:
+                profile = instrumentation.get_profile()
+            finally:
+                summary = instrumentation.stop()
+            # as a conversion worker does
+            instrumentation.call_in_span('Comptes 2023.ods', False, count_rows, 1, **profile)
+            self.assertTrue(p.exists(), 'The span profiled in a worker should be dumped')
+        self.assertEqual(str(p), summary['profile'])
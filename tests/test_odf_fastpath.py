@@ -0,0 +1,49 @@
+from unittest import TestCase
+from finance.ods_io import SpreadsheetWrapper
+from finance.ods_io import SheetWrapper
+from odf.table import Table, TableRow
+import finance.odf_fastpath as odf_fastpath
+import pandas as pd
+import tempfile
+import zipfile
+from pathlib import Path
+
+
+def write_sheet(enabled: bool) -> str:
+    """ the body of the content.xml of a workbook written in bulk, with or without the shortcuts.
+    The namespace declarations are left out, odfpy adds to them as the elements are created"""
+    saved = odf_fastpath.enabled
+    odf_fastpath.enabled = enabled
+    try:
+        df = pd.DataFrame({'Date': [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-02 10:30')],
+                           'Dépense': [12.5, None],
+                           'Description': ['Courses', 'Loyer']})
+        wkb = SpreadsheetWrapper()
+        t = Table(name='Test')
+        wkb.element.spreadsheet.addElement(t)
+        sheet = SheetWrapper(t)
+        # the rows go before the empty row, the first one found
+        sheet.insert_from_array([['Titre']])
+        sheet.insert_rows([TableRow()])
+        sheet.insert_from_array([['Fin']])
+        sheet.insert_from_dataframe(df, include_headers=True, mode='append', bulk=True)
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('test.ods')
+            wkb.save(p)
+            with zipfile.ZipFile(p) as z:
+                content = z.read('content.xml').decode('utf-8')
+        return content[content.index('<office:body>'):]
+    finally:
+        odf_fastpath.enabled = saved
+
+
+class TestOdfFastpath(TestCase):
+    def test_supported_version(self):
+        self.assertIn(odf_fastpath.ODFPY_VERSION, odf_fastpath.SUPPORTED_VERSIONS,
+                      'odfpy was updated : check that the shortcuts still write the same workbook, '
+                      'then add the version to SUPPORTED_VERSIONS')
+        self.assertTrue(odf_fastpath.enabled)
+
+    def test_same_workbook(self):
+        self.assertEqual(write_sheet(False), write_sheet(True),
+                         'The shortcuts should write the same workbook as the DOM methods')
@@ -2,6 +2,12 @@ from unittest import TestCase
 from finance.ods_io import SpreadsheetWrapper
 from finance.ods_io import SheetWrapper
 from finance.ods_io import RowWrapper
+from finance.ods_io import generate_cell_empty
+from finance.ods_io import generate_table_cell_text
+from odf.table import Table, TableRow, TableCell
+from odf.text import P
+import pandas as pd
+import tempfile
 from pathlib import Path
 class TestSpreadsheetWrapper(TestCase):
     __sh__ = None
@@ -39,3 +45,141 @@ class TestSpreadsheetWrapper(TestCase):
         self.assertGreater(sheet.get_row_count(), 0, '0 rows found')
 
 
+
+
+class TestRowWrapper(TestCase):
+    def get_row(self) -> RowWrapper:
+        rwrap = RowWrapper('ro1')
+        rwrap.element.addElement(generate_cell_empty('ce1', 'val1'))
+        rwrap.element.addElement(generate_cell_empty(rule='val2'))
+        span = generate_cell_empty('ce3')
+        span.setAttribute('numbercolumnsrepeated', '1000')
+        rwrap.element.addElement(span)
+        return rwrap
+
+    def test_get_cell_count(self):
+        rwrap = self.get_row()
+        self.assertEqual(1002, rwrap.get_cell_count(), 'Repeated columns are not counted')
+
+    def test_get_cell_style(self):
+        rwrap = self.get_row()
+        self.assertEqual('ce1', rwrap.get_cell_style(0))
+        self.assertEqual('ro1', rwrap.get_cell_style(1), 'The row style should be the default')
+        self.assertEqual('ce3', rwrap.get_cell_style(2))
+        self.assertEqual('ce3', rwrap.get_cell_style(1001))
+        self.assertIsNone(rwrap.get_cell_style(1002))
+
+    def test_get_cell_validation(self):
+        rwrap = self.get_row()
+        self.assertEqual('val1', rwrap.get_cell_validation(0))
+        self.assertEqual('val2', rwrap.get_cell_validation(1))
+        self.assertEqual('', rwrap.get_cell_validation(500))
+
+    def test_get_runs(self):
+        rwrap = RowWrapper()
+        rwrap.element.addElement(generate_table_cell_text('a'))
+        rwrap.element.addElement(TableCell(numbercolumnsrepeated='2'))
+        rwrap.element.addElement(generate_table_cell_text('b'))
+        rwrap.element.addElement(TableCell(numbercolumnsrepeated='16000'))
+        self.assertEqual([('a', 1), ('', 2), ('b', 1)], rwrap.get_runs(), 'The trailing empty cells were kept')
+        self.assertEqual(['a', '', '', 'b'], rwrap.get_values())
+
+    def test_replace_element(self):
+        rwrap = self.get_row()
+        self.assertEqual(1002, rwrap.get_cell_count())
+        rwrap.element = RowWrapper().element
+        self.assertEqual(0, rwrap.get_cell_count(), 'The cell index was not reset')
+
+
+class TestSheetWrapper(TestCase):
+    def test_row_index(self):
+        sheet = SheetWrapper(Table(name='Test'))
+        self.assertEqual(0, sheet.get_row_count())
+        sheet.insert_from_array([['a', 1.0], ['b', 2.0]])
+        self.assertEqual(2, sheet.get_row_count(), 'The row index was not reset after the insertion')
+        sheet.insert_from_array([['c', 3.0]])
+        self.assertEqual(3, len(list(sheet.iter_rows())))
+        rwrap = RowWrapper()
+        rwrap.element = sheet.get_row(2)
+        self.assertEqual(['c', '3.0'], rwrap.get_values())
+
+    def test_iter_values(self):
+        sheet = SheetWrapper(Table(name='Test'))
+        sheet.insert_from_array([['a']])
+        sheet.get_row(0).setAttribute('numberrowsrepeated', '2')
+        sheet.insert_rows([TableRow(numberrowsrepeated='3')])
+        sheet.insert_from_array([['b']])
+        sheet.insert_rows([TableRow(numberrowsrepeated='1048000')])
+        self.assertEqual([['a'], ['a'], [], [], [], ['b']], list(sheet.iter_values()))
+
+    def test_to_dataframe(self):
+        sheet = SheetWrapper(Table(name='Test'))
+        sheet.insert_from_array([['Relevé']])
+        df = pd.DataFrame({'Date': [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-02')],
+                           'Dépense': [12.5, None],
+                           'Description': ['Courses', 'Loyer']})
+        sheet.insert_from_dataframe(df, include_headers=True, mode='append', bulk=True)
+        currency = TableCell(valuetype='currency', value='-3.5', currency='EUR')
+        currency.addElement(P(text='-3,50 €'))
+        row = sheet.get_row(3)
+        empty_cell = row.childNodes[1]
+        row.insertBefore(currency, empty_cell)
+        row.removeChild(empty_cell)
+
+        result = sheet.to_dataframe(header_row=1)
+        self.assertEqual(['Date', 'Dépense', 'Description'], list(result.columns))
+        self.assertEqual('datetime64[ns]', str(result['Date'].dtype))
+        self.assertEqual('float64', str(result['Dépense'].dtype))
+        self.assertEqual([12.5, -3.5], result['Dépense'].tolist(), 'The currency was not read as a number')
+
+        result = sheet.to_dataframe(header_row=1, region=(3, None, 1, 2))
+        self.assertEqual(['Dépense'], list(result.columns))
+        self.assertEqual([-3.5], result['Dépense'].tolist())
+
+    def test_bulk_insert_from_dataframe(self):
+        df = pd.DataFrame({'Date': [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-02 10:30')],
+                           'Dépense': [12.5, None],
+                           'Description': ['Courses', 'Loyer']})
+        values = {}
+        for bulk in (False, True):
+            sheet = SheetWrapper(Table(name='Test'))
+            sheet.insert_from_array([['Titre']])
+            template = RowWrapper('ro1')
+            for style in ['ce1', 'ce2', 'ce3', 'ce4']:
+                template.element.addElement(generate_cell_empty(style, 'val_' + style))
+            sheet.insert_rows([template.element])
+            sheet.insert_from_dataframe(df, include_headers=True, mode='append', bulk=bulk)
+            self.assertEqual(5, sheet.get_row_count())
+            rwrap = RowWrapper()
+            rwrap.element = sheet.get_row(2)
+            self.assertEqual(4, rwrap.get_cell_count(), 'The extra styled cell was not created')
+            self.assertEqual('ce2', rwrap.get_cell_style(1))
+            self.assertEqual('val_ce4', rwrap.get_cell_validation(3))
+            values[bulk] = rwrap.get_values()
+            rwrap.element = sheet.get_row(3)
+            self.assertEqual('02/01/2023 10:30', rwrap.get_values()[0])
+        self.assertEqual(values[False], values[True], 'The bulk mode does not write the same values')
+
+
+class TestSpreadsheetWrapperLoad(TestCase):
+    def test_load_sheet_names(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            wkb = SpreadsheetWrapper()
+            for name in ['Mouvements', 'Salaires']:
+                sheet = Table(name=name)
+                wkb.element.spreadsheet.addElement(sheet)
+                SheetWrapper(sheet).insert_from_array([[name, 1.0]])
+            wkb.save(p)
+
+            full = SpreadsheetWrapper()
+            full.load(p)
+            partial = SpreadsheetWrapper()
+            partial.load(p, ['Salaires'])
+            self.assertEqual(['Mouvements', 'Salaires'], list(full.get_sheets()))
+            self.assertEqual(['Salaires'], list(partial.get_sheets()), 'The sheets are shared between workbooks')
+            rwrap = RowWrapper()
+            rwrap.element = partial.get_sheets()['Salaires'].get_row(0)
+            self.assertEqual(['Salaires', '1.0'], rwrap.get_values())
+            with self.assertRaises(ValueError):
+                partial.save(Path(folder).joinpath('copy.ods'))
@@ -0,0 +1,92 @@
+from unittest import TestCase
+from finance.ods_io import SpreadsheetWrapper
+from finance.ods_io import generate_table_cell_text, generate_table_cell_float, generate_table_cell_datetime
+from finance.ods_reader import SheetReader
+from odf.table import Table, TableRow, TableCell
+from odf.text import P
+from pathlib import Path
+import datetime as dt
+import tempfile
+
+
+def generate_workbook(p: Path):
+    """ creates a workbook with a Mouvements sheet surrounded by other sheets"""
+    wkb = SpreadsheetWrapper()
+    for name in ['Synthèse', 'Mouvements', 'Salaires']:
+        t = Table(name=name)
+        row = TableRow()
+        row.addElement(generate_table_cell_text(f'Titre {name}'))
+        t.addElement(row)
+        row = TableRow()
+        for h in ['Date', 'N°', 'Description']:
+            row.addElement(generate_table_cell_text(h))
+        t.addElement(row)
+        for i in range(3):
+            row = TableRow()
+            row.addElement(generate_table_cell_datetime(dt.datetime(2023, 1, i + 1)))
+            row.addElement(generate_table_cell_float(float(i) + 0.5))
+            row.addElement(generate_table_cell_text(f'{name} {i}'))
+            currency = TableCell(valuetype='currency', value='12.5', currency='EUR')
+            currency.addElement(P(text='12,50 €'))
+            row.addElement(currency)
+            row.addElement(TableCell(numbercolumnsrepeated='1024'))
+            t.addElement(row)
+        t.addElement(TableRow(numberrowsrepeated='1048000'))
+        wkb.element.spreadsheet.addElement(t)
+    wkb.save(p)
+
+
+class TestSheetReader(TestCase):
+    def test_iter_rows(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            generate_workbook(p)
+            rows = list(SheetReader(p, 'Mouvements').iter_rows())
+        self.assertEqual(6, len(rows), 'The repeated empty rows should be read only once')
+        self.assertEqual(['Titre Mouvements'], rows[0])
+        self.assertEqual([dt.datetime(2023, 1, 1), 0.5, 'Mouvements 0', '12.5 EUR'], rows[2],
+                         'Trailing cells not trimmed')
+
+    def test_repeated_values(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            wkb = SpreadsheetWrapper()
+            t = Table(name='Mouvements')
+            row = TableRow(numberrowsrepeated='40')
+            row.addElement(generate_table_cell_text('Loyer'))
+            amount = TableCell(valuetype='float', value='800', numbercolumnsrepeated='35')
+            amount.addElement(P(text='800'))
+            row.addElement(amount)
+            row.addElement(TableCell(numbercolumnsrepeated='1024'))
+            t.addElement(row)
+            t.addElement(TableRow(numberrowsrepeated='1048000'))
+            wkb.element.spreadsheet.addElement(t)
+            wkb.save(p)
+            rows = list(SheetReader(p, 'Mouvements').iter_rows())
+        self.assertEqual(41, len(rows), 'The repeated rows holding values should be expanded in full')
+        self.assertEqual(['Loyer'] + [800] * 35, rows[39])
+        self.assertEqual([], rows[40])
+
+    def test_currency_as_number(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            generate_workbook(p)
+            rows = list(SheetReader(p, 'Mouvements', keep_currency=False).iter_rows())
+        self.assertEqual(12.5, rows[2][3])
+
+    def test_read_table(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            generate_workbook(p)
+            headers, rows = SheetReader(p, 'Mouvements').read_table('Date')
+            rows = list(rows)
+        self.assertEqual(['Date', 'N°', 'Description'], headers)
+        self.assertEqual(4, len(rows))
+        self.assertEqual('Mouvements 2', rows[2][2])
+
+    def test_missing_sheet(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('Comptes 2023.ods')
+            generate_workbook(p)
+            with self.assertRaises(KeyError):
+                list(SheetReader(p, 'Inconnu').iter_rows())
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from finance.ods_io import SpreadsheetWrapper, RowWrapper
+from finance.ods_io import generate_table_cell_text, generate_cell_empty
+from finance.ods_reader import SheetReader
+from finance.ods_writer import SpreadsheetStreamWriter
+from odf.table import Table, TableRow
+from pathlib import Path
+import datetime as dt
+import pandas as pd
+import tempfile
+
+
+def generate_template(p: Path):
+    """ creates a template with a title, a styled empty row and a second sheet"""
+    wkb = SpreadsheetWrapper()
+    t = Table(name='Mouvements')
+    row = TableRow()
+    row.addElement(generate_table_cell_text('Mouvements & Co'))
+    t.addElement(row)
+    template = RowWrapper('ro1')
+    for style in ['ce1', 'ce2', 'ce3', 'ce4']:
+        template.element.addElement(generate_cell_empty(style, 'val_' + style))
+    t.addElement(template.element)
+    wkb.element.spreadsheet.addElement(t)
+    wkb.element.spreadsheet.addElement(Table(name='Salaires'))
+    wkb.save(p)
+
+
+class TestSpreadsheetStreamWriter(TestCase):
+    def test_write_dataframe(self):
+        df = pd.DataFrame({'Date': [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-02 10:30')],
+                           'Dépense': [12.5, None],
+                           'Description': ['<Courses>', 'Loyer']})
+        with tempfile.TemporaryDirectory() as folder:
+            template = Path(folder).joinpath('template.ods')
+            target = Path(folder).joinpath('export.ods')
+            generate_template(template)
+            writer = SpreadsheetStreamWriter(template, 'Mouvements')
+            self.assertEqual(2, writer.write_dataframe(target, df, include_headers=True, chunksize=1))
+            rows = list(SheetReader(target, 'Mouvements').iter_rows())
+
+            wkb = SpreadsheetWrapper()
+            wkb.load(target)
+            self.assertIn('Salaires', wkb.get_sheets(), 'The other sheets of the template were not copied')
+            rwrap = RowWrapper()
+            rwrap.element = wkb.get_sheets()['Mouvements'].get_row(2)
+            self.assertEqual('ce2', rwrap.get_cell_style(1), 'The template styles were not applied')
+            self.assertEqual('val_ce4', rwrap.get_cell_validation(3))
+
+        self.assertEqual(['Mouvements & Co'], rows[0])
+        self.assertEqual(['Date', 'Dépense', 'Description'], rows[1])
+        self.assertEqual([dt.datetime(2023, 1, 1), 12.5, '<Courses>'], rows[2])
+        self.assertEqual([dt.datetime(2023, 1, 2, 10, 30), '', 'Loyer'], rows[3])
+        self.assertEqual(5, len(rows), 'The template row should follow the exported rows')
+
+    def test_write_rows(self):
+        def generate_rows():
+            for i in range(3):
+                yield [f'Ligne {i}', float(i)]
+
+        with tempfile.TemporaryDirectory() as folder:
+            template = Path(folder).joinpath('template.ods')
+            target = Path(folder).joinpath('export.ods')
+            generate_template(template)
+            writer = SpreadsheetStreamWriter(template, 'Mouvements', mode='overwrite')
+            self.assertEqual(3, writer.write_rows(target, generate_rows()))
+            rows = list(SheetReader(target, 'Mouvements').iter_rows())
+
+        self.assertEqual([['Ligne 0', 0], ['Ligne 1', 1], ['Ligne 2', 2]], rows)
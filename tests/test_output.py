@@ -0,0 +1,79 @@
+from unittest import TestCase
+from pathlib import Path
+import contextlib
+import io
+import tempfile
+
+import finance.output as o
+
+
+class Counted:
+    """ counts how many times it was rendered"""
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'counted'
+
+
+class TestOutput(TestCase):
+    def tearDown(self):
+        o.flush()
+        o.set_level('info')
+
+    def get_output(self, function, *args) -> str:
+        text = io.StringIO()
+        with contextlib.redirect_stdout(text):
+            function(*args)
+            o.flush()
+        return text.getvalue()
+
+    def test_console(self):
+        def run():
+            o.print_title('Staging')
+            o.print_event('%s files found', 2)
+        lines = self.get_output(run).splitlines()
+        self.assertEqual('*** Staging ***', lines[0])
+        self.assertRegex(lines[1], r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}, 2 files found$')
+
+    def test_redirect(self):
+        text = io.StringIO()
+        with contextlib.redirect_stdout(text):
+            o.print_event('redirected')
+        o.flush()
+        self.assertIn('redirected', text.getvalue(), 'The message should go to the output current when logged')
+
+    def test_levels(self):
+        def run():
+            o.print_event('event')
+            o.print_debug('diagnostic')
+            o.print_warning('warning')
+        o.set_level('quiet')
+        self.assertNotIn('event', self.get_output(run))
+        self.assertIn('warning', self.get_output(run))
+        o.set_level('debug')
+        self.assertIn('diagnostic', self.get_output(run))
+        self.assertTrue(o.is_debug())
+
+    def test_lazy_debug(self):
+        counted = Counted()
+        self.get_output(o.print_debug, 'value : %s', counted)
+        self.assertEqual(0, counted.count, 'The debug messages should not be formatted unless debug is on')
+        o.set_level('debug')
+        self.get_output(o.print_debug, 'value : %s', counted)
+        self.assertEqual(1, counted.count)
+
+    def test_log_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            p = Path(folder).joinpath('finance.log')
+            o.log_to_file(p, max_bytes=200, backup_count=2)
+            file_handler = o.listener.handlers[-1]
+            try:
+                self.get_output(lambda: [o.print_event('event %s', i) for i in range(20)])
+            finally:
+                o.listener.handlers = tuple([h for h in o.listener.handlers if h is not file_handler])
+                file_handler.close()
+            self.assertTrue(p.exists())
+            self.assertTrue(Path(folder).joinpath('finance.log.1').exists(), 'The log file should be rotated')
+            self.assertIn('event 19', p.read_text(encoding='utf-8'))